@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Headless batch analysis of frequency logs
+
+Example
+------
+python batch.py "logs/*.csv" --devs "ADEV ovlp" HDEV --tau-grid octave --png
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+import src.frequency_stability as fs
+from src.loader import load_file
+from utils import save_csv
+
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(
+        description='Calculate frequency stability of many files without GUI'
+    )
+    parser.add_argument('inputs', nargs='+', help='input files or glob patterns')
+    parser.add_argument('-o', '--output-dir', default='./data', help='directory of results')
+    parser.add_argument('--devs', nargs='+', default=['ADEV ovlp'],
+                        choices=list(fs.deviation_kernels), help='deviations to calculate')
+    parser.add_argument('--tau-min', type=float, help='minimal tau [s], 1/f_sampling by default')
+    parser.add_argument('--tau-max', type=float, help='maximal tau [s], N/2/f_sampling by default')
+    parser.add_argument('--tau-n', type=int, default=20, help='number of taus or taus per decade')
+    parser.add_argument('--tau-grid', default='linear', choices=fs.tau_grid_modes)
+    parser.add_argument('--f0', type=float, help='central frequency [Hz], from metadata by default')
+    parser.add_argument('--fs', type=float, help='sampling frequency [Hz], from metadata by default')
+    parser.add_argument('--use-mean', action='store_true', help='use data mean as central frequency')
+    parser.add_argument('--float32', action='store_true', help='store fractional frequency in float32, halves memory')
+    parser.add_argument('--png', action='store_true', help='render deviation plots')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='files analysed in parallel')
+    parser.add_argument('--no-cache', action='store_true', help='do not use parsed data cache')
+
+    return parser.parse_args(argv)
+
+def expand_inputs(patterns):
+
+    ret = []
+    for pattern in patterns:
+        tmp = sorted(glob.glob(pattern))
+        ret += tmp if tmp else [pattern]
+
+    # keep order, drop duplicates
+    return list(dict.fromkeys(ret))
+
+def output_path(input_path, output_dir, ext):
+
+    name = os.path.splitext(os.path.basename(input_path))[0]
+
+    return os.path.join(output_dir, '{}_deviation.{}'.format(name, ext))
+
+def plot_deviations(path, taus, devs, conf_int):
+
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = Figure(dpi=150)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.set_xlabel('Tau [s]')
+    ax.set_ylabel('Deviation')
+    ax.set_yscale('log')
+    ax.grid(True)
+
+    for key, value in devs.items():
+        ax.errorbar(
+            taus,
+            value,
+            yerr=np.abs(conf_int[key] - value),
+            label=key,
+            fmt='o',
+            markersize=4
+        )
+    ax.legend(loc=0)
+
+    fig.tight_layout()
+    fig.savefig(path)
+
+def analyse_file(path, args):
+    """Analyse one file, returns dict of timings or error message"""
+
+    ret = {'file': path}
+    start = time.time()
+
+    try:
+        freqs, meta = load_file(path, cache=not args.no_cache)
+    except (OSError, KeyError, ValueError) as e:
+        ret['error'] = str(e)
+        return ret
+    ret['load [s]'] = time.time() - start
+    ret['N'] = freqs.size
+
+    try:
+        f0 = args.f0 if args.f0 is not None else meta['Central frequency [Hz]']
+        f_sampling = args.fs if args.fs is not None else meta['Sampling frequency [Hz]']
+    except KeyError:
+        ret['error'] = 'Could not find needed parameters!'
+        return ret
+    if args.use_mean:
+        f0 = np.average(freqs)
+
+    N = freqs.size
+    tau_min = args.tau_min if args.tau_min is not None else 1/f_sampling
+    tau_max = args.tau_max if args.tau_max is not None else N/2/f_sampling
+    if tau_min < 1/f_sampling:
+        ret['error'] = 'Minimal tau below sampling limit!'
+        return ret
+    if tau_max > N/2/f_sampling:
+        ret['error'] = 'Maximal tau above sampling limit!'
+        return ret
+    if tau_max <= tau_min:
+        ret['error'] = 'Tau max lower or equal than tau min!'
+        return ret
+
+    # one failing file must not abort the others in the pool
+    try:
+        # Analysis
+        start = time.time()
+        taus = fs.calc_tau_grid(tau_min, tau_max, f_sampling, mode=args.tau_grid, tau_N=args.tau_n)
+        cum_phase = fs.CumulativePhase.from_frequency(
+            freqs, f0, f_sampling, dtype=np.float32 if args.float32 else np.float64)
+        res = fs.calc_deviations(cum_phase.phase_error, taus, f_sampling, args.devs)
+        alphas = fs.calc_noise_id(cum_phase, taus, f_sampling)
+
+        devs = {}
+        conf_int = {}
+        for dev in args.devs:
+            devs[dev] = res[dev]
+            conf_int[dev] = fs.calc_confidence_interval(res[dev], taus, f_sampling, alphas, N, dev)
+        ret['analyse [s]'] = time.time() - start
+
+        # Same layout as FrequencyStability.saveDeviations
+        start = time.time()
+        data = {
+            'Tau [s]': taus
+        }
+        for key, value in devs.items():
+            data[key] = value
+            data['Lower bound {}'.format(key)] = conf_int[key][0]
+            data['Upper bound {}'.format(key)] = conf_int[key][1]
+        data['Noise type'] = fs.dominant_noise(alphas)
+
+        meta = {
+            'Central frequency [Hz]': f0,
+            'Sampling frequency [Hz]': f_sampling,
+            'Total samples': N
+        }
+
+        os.makedirs(args.output_dir, exist_ok=True)
+        save_csv(data, output_path(path, args.output_dir, 'csv'), meta)
+        if args.png:
+            plot_deviations(output_path(path, args.output_dir, 'png'), taus, devs, conf_int)
+        ret['save [s]'] = time.time() - start
+    except Exception as e:
+        ret['error'] = '{}: {}'.format(type(e).__name__, e)
+
+    return ret
+
+def print_summary(results, total):
+
+    print('{:<40} {:>12} {:>10} {:>12} {:>10}'.format(
+        'File', 'N', 'load [s]', 'analyse [s]', 'save [s]'))
+    for ret in results:
+        name = os.path.basename(ret['file'])
+        if 'error' in ret:
+            print('{:<40} error: {}'.format(name, ret['error']))
+            continue
+        print('{:<40} {:>12d} {:>10.2f} {:>12.2f} {:>10.2f}'.format(
+            name, ret['N'], ret['load [s]'], ret['analyse [s]'], ret['save [s]']))
+    print('Total wall time: {:.2f} s'.format(total))
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+    paths = expand_inputs(args.inputs)
+
+    start = time.time()
+    with Pool(max(min(args.processes, len(paths)), 1)) as pool:
+        results = pool.starmap(analyse_file, [(path, args) for path in paths])
+
+    print_summary(results, time.time() - start)
+
+    sys.exit(1 if any('error' in ret for ret in results) else 0)
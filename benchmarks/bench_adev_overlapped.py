@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import src.frequency_stability as fs
+
+
+def calc_ADEV_overlapped_single_loop(phase_error, tau, f_sampling):
+    # Per-sample reference implementation the vectorised kernel replaced
+
+    N = phase_error.size
+    n = tau * f_sampling # averaging factor
+    n = int(np.floor(n))
+
+    ret = 0
+    for i in range(N - 2*n):
+        tmp = phase_error[i + 2*n]
+        tmp -= 2*phase_error[i+n]
+        tmp += phase_error[i]
+
+        ret += np.power(tmp, 2)
+
+    ret /= (2*(N - 2*n)*np.power(tau, 2))
+    ret = np.sqrt(ret)
+
+    return ret
+
+def timeit(func, *args, repeat=1):
+
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func(*args)
+        stop = time.perf_counter()
+        best = min(best, stop - start)
+
+    return best, ret
+
+
+if __name__ == '__main__':
+
+    N = int(1e6)
+    f_sampling = 1e3
+    tau = 0.1
+
+    rng = np.random.default_rng(0)
+    fs_frac = rng.standard_normal(N) * 1e-9
+    phase_error = fs.calc_phase_error(fs_frac, f_sampling)
+
+    t_loop, ref = timeit(calc_ADEV_overlapped_single_loop, phase_error, tau, f_sampling)
+    t_vec, ret = timeit(fs.calc_ADEV_overlapped_single, phase_error, tau, f_sampling, repeat=5)
+
+    print('N = {:.0e}, tau = {} s'.format(N, tau))
+    print('loop:       {:.4f} s  ADEV = {:.6e}'.format(t_loop, ref))
+    print('vectorised: {:.4f} s  ADEV = {:.6e}'.format(t_vec, ret))
+    print('relative difference: {:.2e}'.format(abs(ret - ref)/ref))
+    print('speedup: {:.0f}x'.format(t_loop/t_vec))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Accuracy and speed of calc_MDEV_sumsq on long random walk FM records
+
+Example
+------
+python benchmarks/bench_mdev.py --sizes 2e6 2e7
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import src.frequency_stability as fs
+
+
+block = 2**20 # window sums evaluated at once by the reference
+
+
+def calc_MDEV_sumsq_direct(phase_error, n):
+    # Moving sums of n second differences, O(N n) but free of cancellation
+
+    tmp = fs.calc_second_diff(phase_error, n)
+
+    ret = 0.
+    count = 0
+    for start in range(0, tmp.size, block):
+        w = np.convolve(tmp[start:start+block+n-1], np.ones(n), 'valid')
+        ret += np.dot(w, w)
+        count += w.size
+
+    return ret, count * n**2
+
+def compare(N, strides, seed=0):
+
+    rng = np.random.default_rng(seed)
+    phase_error = np.cumsum(np.cumsum(rng.standard_normal(N))) # random walk FM
+
+    print('N = {:.0e}, random walk FM'.format(N))
+    for n in strides:
+        if 3*n > N:
+            continue
+        start = time.perf_counter()
+        ret, count = fs.calc_MDEV_sumsq(phase_error, n)
+        t_fast = time.perf_counter() - start
+        start = time.perf_counter()
+        ref, ref_count = calc_MDEV_sumsq_direct(phase_error, n)
+        t_direct = time.perf_counter() - start
+
+        print('n = {:<6d} fast {:.3f} s, direct {:.3f} s, relative difference {:.2e}{}'.format(
+            n, t_fast, t_direct, abs(ret/ref - 1), '' if count == ref_count else ', count differs!'))
+    print()
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Compare MDEV kernel with direct moving sums')
+    parser.add_argument('--sizes', nargs='+', type=float, default=[2e6, 2e7], help='record lengths')
+    parser.add_argument('--strides', nargs='+', type=int, default=[1, 8, 64, 1000])
+    args = parser.parse_args()
+
+    for N in args.sizes:
+        compare(int(N), args.strides)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import src.frequency_stability as fs
+
+
+# Per-sample reference implementations the vectorised versions replaced
+def calc_array_avg_loop(arr, tau, f_sampling):
+
+    n = tau * f_sampling # averaging factor
+    n = int(np.floor(n)) + 1
+    loop_count = arr.size / n
+    loop_count = int(np.floor(loop_count))
+
+    ret = []
+    iter = 0
+    for _ in range(loop_count):
+        ret.append(np.average(arr[iter:iter+n]))
+        iter += n
+
+    return np.array(ret)
+
+def calc_r1_loop(fs_frac):
+
+    f_avg = np.average(fs_frac)
+    N = fs_frac.size
+    nom = 0
+    denom = 0
+
+    # Numerator
+    for i in range(N-1):
+        nom += (fs_frac[i] - f_avg) * (fs_frac[i+1] - f_avg)
+    # Denominator
+    for i in range(N):
+        denom += np.power(fs_frac[i] - f_avg, 2)
+
+    ret = nom/denom
+
+    return ret
+
+def calc_noise_type_loop(arr_avg):
+
+    flag = True
+    d = 0
+    ret = 0
+    z = arr_avg
+
+    while(flag):
+        r1 = calc_r1_loop(z)
+        delta = r1/(r1+1)
+
+        if (delta < .25):
+            p = -2*(delta + d)
+            ret = p # for frequency data
+            flag = False
+        else:
+            z = fs.calc_array_diff(z)
+            d += 1
+
+    return ret
+
+def calc_noise_id_loop(freqs, taus, f_sampling):
+
+    ret = []
+
+    for tau in taus:
+        tmp = calc_array_avg_loop(freqs, tau, f_sampling)
+        ret.append(calc_noise_type_loop(tmp))
+
+    return np.array(ret)
+
+
+if __name__ == '__main__':
+
+    N = int(1e5)
+    f_sampling = 1e2
+    taus = np.linspace(0.01, 0.49*N/f_sampling, 20)
+
+    rng = np.random.default_rng(0)
+    freqs = 1e6 + rng.standard_normal(N) * 1e-3
+
+    start = time.perf_counter()
+    ref = calc_noise_id_loop(freqs, taus, f_sampling)
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ret = fs.calc_noise_id(freqs, taus, f_sampling)
+    t_vec = time.perf_counter() - start
+
+    print('N = {:.0e}, {} taus'.format(N, taus.size))
+    print('loop:       {:.4f} s'.format(t_loop))
+    print('vectorised: {:.4f} s'.format(t_vec))
+    print('max abs difference: {:.2e}'.format(np.max(np.abs(ret - ref))))
+    print('speedup: {:.0f}x'.format(t_loop/t_vec))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite of src.frequency_stability
+
+Example
+------
+python benchmarks/bench_suite.py --sizes 1e3 1e4 1e5 -o new.json --baseline old.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import src.frequency_stability as fs
+
+
+f0 = 1e6 # Hz
+f_sampling = 1. # Hz
+
+
+# ----- Cases -----
+def prepare(N, grid):
+
+    rng = np.random.default_rng(0)
+    data = {}
+    data['freqs'] = f0 + f0 * 1e-9 * rng.standard_normal(N)
+    data['fs_frac'] = fs.calc_fractional_frequency(data['freqs'], f0)
+    data['phase_error'] = fs.calc_phase_error(data['fs_frac'], f_sampling)
+
+    mode, _, tau_N = grid.partition(':')
+    data['taus'] = fs.calc_tau_grid(
+        1/f_sampling,
+        N/4/f_sampling,
+        f_sampling,
+        mode=mode,
+        tau_N=int(tau_N) if tau_N else 20
+    )
+    data['devs'] = fs.calc_ADEV_overlapped(data['phase_error'], data['taus'], f_sampling)
+    data['alphas'] = fs.calc_noise_id(data['freqs'], data['taus'], f_sampling)
+
+    return data
+
+# name: (callable(data), depends on tau grid)
+cases = {
+    'calc_fractional_frequency': (lambda d: fs.calc_fractional_frequency(d['freqs'], f0), False),
+    'calc_phase_error': (lambda d: fs.calc_phase_error(d['fs_frac'], f_sampling), False),
+    'CumulativePhase.from_frequency': (lambda d: fs.CumulativePhase.from_frequency(
+        d['freqs'], f0, f_sampling), False),
+    'CumulativePhase.from_frequency float32': (lambda d: fs.CumulativePhase.from_frequency(
+        d['freqs'], f0, f_sampling, dtype=np.float32), False),
+    'calc_ADEV': (lambda d: fs.calc_ADEV(d['phase_error'], d['taus'], f_sampling), True),
+    'calc_ADEV_overlapped': (lambda d: fs.calc_ADEV_overlapped(d['phase_error'], d['taus'], f_sampling), True),
+    'calc_HDEV': (lambda d: fs.calc_HDEV(d['phase_error'], d['taus'], f_sampling), True),
+    'calc_HDEV_nonoverlapped': (lambda d: fs.calc_HDEV_nonoverlapped(d['phase_error'], d['taus'], f_sampling), True),
+    'calc_deviations': (lambda d: fs.calc_deviations(d['phase_error'], d['taus'], f_sampling), True),
+    'calc_TheoH': (lambda d: fs.calc_TheoH(d['phase_error'], d['taus'], f_sampling, max_window=2**12), True),
+    'calc_noise_id': (lambda d: fs.calc_noise_id(d['freqs'], d['taus'], f_sampling), True),
+    'calc_confidence_interval': (lambda d: fs.calc_confidence_interval(
+        d['devs'], d['taus'], f_sampling, d['alphas'], d['freqs'].size), True)
+}
+
+def measure(func, data, repeat):
+    """Best wall time of repeat runs and peak traced memory of one run"""
+
+    best = np.inf
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(data)
+            best = min(best, time.perf_counter() - start)
+
+        tracemalloc.start()
+        func(data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return best, peak
+
+# ----- Suite -----
+def run(sizes, grids, functions, repeat):
+
+    ret = []
+    for N in sizes:
+        for k, grid in enumerate(grids):
+            data = prepare(N, grid)
+            for name in functions:
+                func, tau_dependent = cases[name]
+                # grid independent cases run once per size
+                if not tau_dependent and k > 0:
+                    continue
+                t, peak = measure(func, data, repeat)
+                ret.append({
+                    'function': name,
+                    'N': N,
+                    'grid': grid if tau_dependent else '',
+                    'taus': int(data['taus'].size) if tau_dependent else 0,
+                    'time [s]': t,
+                    'peak memory [B]': peak
+                })
+                print('{:<28} N={:<10.0e} {:<10} {:>10.4f} s {:>10.1f} MiB'.format(
+                    name, N, ret[-1]['grid'], t, peak / 2**20))
+            del data
+
+    return ret
+
+def compare(results, baseline, threshold):
+    """Print ratios to baseline, returns list of regressions"""
+
+    reference = {(r['function'], r['N'], r['grid']): r for r in baseline['results']}
+
+    ret = []
+    print('\n{:<28} {:<10} {:<10} {:>8} {:>8}'.format('Function', 'N', 'Grid', 'time', 'memory'))
+    for r in results:
+        key = (r['function'], r['N'], r['grid'])
+        if key not in reference:
+            continue
+        ratio_t = r['time [s]'] / max(reference[key]['time [s]'], 1e-12)
+        ratio_m = r['peak memory [B]'] / max(reference[key]['peak memory [B]'], 1)
+        flag = ''
+        if ratio_t > threshold or ratio_m > threshold:
+            flag = 'REGRESSION'
+            ret.append(key)
+        print('{:<28} {:<10.0e} {:<10} {:>7.2f}x {:>7.2f}x {}'.format(
+            key[0], key[1], key[2], ratio_t, ratio_m, flag))
+
+    return ret
+
+def parse_args(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark calc_* functions')
+    parser.add_argument('--sizes', nargs='+', type=float,
+                        default=[1e3, 1e4, 1e5, 1e6, 1e7, 1e8], help='data lengths')
+    parser.add_argument('--grids', nargs='+', default=['octave', 'decade:5', 'decade:20', 'linear:20'],
+                        help='tau grids as mode[:tau_N]')
+    parser.add_argument('--functions', nargs='+', default=list(cases), choices=list(cases))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per timing')
+    parser.add_argument('-o', '--output', default='bench_results.json', help='results file')
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='time or memory ratio flagged as regression')
+
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+
+    args = parse_args()
+
+    results = run([int(N) for N in args.sizes], args.grids, args.functions, args.repeat)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'meta': {
+                'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'machine': platform.platform()
+            },
+            'results': results
+        }, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('\n{} regressions above {:.2f}x'.format(len(regressions), args.threshold))
+            sys.exit(1)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import src.frequency_stability as fs
+
+
+def calc_Theo1_single_loop(phase_error, tau, f_sampling):
+    # Per-term reference implementation of the Theo1 definition
+
+    N = phase_error.size
+    m = fs.calc_Theo1_window(tau, f_sampling)
+    k = m // 2
+
+    ret = 0
+    for i in range(N - m):
+        for d in range(k):
+            tmp = phase_error[i] - phase_error[i + k - d]
+            tmp += phase_error[i + m] - phase_error[i + k + d]
+
+            ret += np.power(tmp, 2) / (k - d)
+
+    ret /= (0.75*(N - m)*np.power(m/f_sampling, 2))
+    ret = np.sqrt(ret)
+
+    return ret
+
+def calc_Theo1_single_direct(phase_error, tau, f_sampling):
+    # Vectorised over positions, one pass per term of the window
+
+    m = fs.calc_Theo1_window(tau, f_sampling)
+
+    ret, count = fs.calc_Theo1_direct_sumsq(phase_error, m)
+
+    ret /= (0.75*count*np.power(m/f_sampling, 2))
+    ret = np.sqrt(ret)
+
+    return ret
+
+def timeit(func, *args, repeat=1):
+
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ret = func(*args)
+        stop = time.perf_counter()
+        best = min(best, stop - start)
+
+    return best, ret
+
+def compare(N, tau, loop=True, noise='white FM'):
+
+    f_sampling = 1.
+
+    rng = np.random.default_rng(0)
+    fs_frac = rng.standard_normal(N) * 1e-9
+    if noise == 'random walk FM':
+        fs_frac = np.cumsum(fs_frac) * 1e-3
+    phase_error = fs.calc_phase_error(fs_frac, f_sampling)
+
+    print('N = {:.0e}, tau = {} s, {}'.format(N, tau, noise))
+    t_fast, ret = timeit(fs.calc_Theo1_single, phase_error, tau, f_sampling, repeat=3)
+    t_direct, ref = timeit(calc_Theo1_single_direct, phase_error, tau, f_sampling)
+    if loop:
+        t_loop, ref = timeit(calc_Theo1_single_loop, phase_error, tau, f_sampling)
+        print('loop:       {:.4f} s  Theo1 = {:.6e}'.format(t_loop, ref))
+    print('direct:     {:.4f} s'.format(t_direct))
+    print('fast:       {:.4f} s  Theo1 = {:.6e}'.format(t_fast, ret))
+    t_dec, dec = timeit(fs.calc_Theo1_single, phase_error, tau, f_sampling, 2**10, repeat=3)
+    print('decimated:  {:.4f} s  Theo1 = {:.6e}'.format(t_dec, dec))
+    print('relative difference: {:.2e} (fast), {:.2e} (decimated)'.format(
+        abs(ret - ref)/ref, abs(dec - ref)/ref))
+    print('speedup: {:.0f}x over direct{}\n'.format(
+        t_direct/t_fast, ', {:.0f}x over loop'.format(t_loop/t_fast) if loop else ''))
+
+
+if __name__ == '__main__':
+
+    compare(int(2e3), 150.)
+    compare(int(1e5), 3e4, loop=False)
+    compare(int(1e5), 5.25e4, loop=False) # window 0.7 N
+    compare(int(2e3), 150., noise='random walk FM')
+    compare(int(1e6), 1.5e3, loop=False, noise='random walk FM')
+    compare(int(1e6), 1.5e4, loop=False, noise='random walk FM')
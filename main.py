@@ -6,12 +6,16 @@ import os
 import yaml
 
 import numpy as np
+import matplotlib.colors as colors
 
 from misc.generators import generate_widgets, generate_layout
-from widgets.DialogProgress import calcDeviationProgress
+from widgets.DialogProgress import DialogAnalysisProgress
+from widgets.AnalysisWorker import AnalysisWorker
 import src.frequency_stability as fs
-from utils import read_csv, save_csv
+from src.loader import load_file, calc_file_key
+from utils import save_csv
 
+from PyQt5.QtCore import QThread
 from PyQt5.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -21,8 +25,18 @@ from PyQt5.QtWidgets import (
 )
 
 
-available_files = '(*.csv *.txt)'
+available_files = '(*.csv *.txt *.f64)'
 tau_ext_margin = 0.001 # Hz
+# deviation name: checkbox
+deviation_checks = {
+    'ADEV': 'checkAllan',
+    'ADEV ovlp': 'checkAllanOvlp',
+    'HDEV': 'checkHadamard',
+    'HDEV non-ovlp': 'checkHadamardNonOvlp',
+    'MDEV': 'checkModAllan',
+    'TDEV': 'checkTime',
+    'TOTDEV': 'checkTotal'
+}
 
 def dialogWarning(msg):
     msgBox = QMessageBox()
@@ -42,14 +56,23 @@ class FrequencyStability(QMainWindow):
         layout_conf = self.getLayoutConfig()
 
         # Variables
-        self._data = None
+        self._data = None # frequencies [Hz], memory-mapped
+        self._fingerprint = None # identifies loaded file in result cache
         self._meta = None
         self._params = {}
+        self._cum_phase = None # cumulative phase of loaded data
+        self._cum_phase_key = None
+        self._envelope = None # plot envelope of its fractional frequency
+        self._thread = None # analysis worker thread
+        self._worker = None
+        self._progress = None
+        self._dev_cache = fs.DeviationCache() # per-stride results
 
         self._taus = [] # averaging times
         self._devs = {} # deviations
         self._conf_int = {} # confidence intervals
         self._noise_type = []
+        self._dynamic = None # dynamic Allan deviation map
 
         self.initWidgets(widgets_conf)
         self.initLayout(layout_conf)
@@ -121,12 +144,17 @@ class FrequencyStability(QMainWindow):
             dialogWarning('Choose only one file!')
             return False
         else:
-            data, meta = read_csv(inputPaths[0][0])
-            if 'Frequency [Hz]' not in data.columns:
+            try:
+                data, meta = load_file(inputPaths[0][0])
+            except KeyError:
                 dialogWarning('Could not find frequency column in data!')
                 return False
             self._data = data
             self._meta = meta
+            self._fingerprint = calc_file_key(inputPaths[0][0])
+            self._cum_phase = None
+            self._cum_phase_key = None
+            self._envelope = None
             self._widgets['editFileInput'].setText(inputPaths[0][0])
             return True
 
@@ -175,11 +203,7 @@ class FrequencyStability(QMainWindow):
         if self._data is None:
             dialogWarning('Load data first!')
             return False
-        try:
-            tmp['N'] = self._data['Frequency [Hz]'].size
-        except KeyError:
-            dialogWarning('Could not find frequency column in data!')
-            return False
+        tmp['N'] = self._data.size
         
         # Parameters from settings section
         try:
@@ -188,6 +212,15 @@ class FrequencyStability(QMainWindow):
             tmp['Tau min [s]'] = float(self._widgets['tauMin'].text())
             tmp['Tau max [s]'] = float(self._widgets['tauMax'].text())
             tmp['Tau N'] = int(self._widgets['tauN'].text())
+            tmp['Tau grid'] = self._widgets['tauGrid'].currentText()
+            tmp['Workers'] = int(self._widgets['workers'].text())
+            tmp['Float32'] = self._widgets['checkFloat32'].isChecked()
+            tmp['Memory report'] = self._widgets['checkMemory'].isChecked()
+            tmp['Dynamic window [s]'] = None
+            tmp['Dynamic step [s]'] = None
+            if self._widgets['checkDynamic'].isChecked():
+                tmp['Dynamic window [s]'] = float(self._widgets['dynWindow'].text())
+                tmp['Dynamic step [s]'] = float(self._widgets['dynStep'].text())
         except ValueError:
             dialogWarning('Could not read parameters!')
             return False
@@ -202,136 +235,170 @@ class FrequencyStability(QMainWindow):
         if tmp['Tau max [s]'] <= tmp['Tau min [s]']:
             dialogWarning('Tau max lower or equal than tau min!')
             return False
+
+        if tmp['Workers'] < 1:
+            dialogWarning('Number of workers must be positive!')
+            return False
+
+        # Dynamic deviation window
+        if tmp['Dynamic window [s]'] is not None:
+            if tmp['Dynamic window [s]'] > tmp['N']/tmp['Sampling frequency [Hz]']:
+                dialogWarning('Dynamic window longer than data!')
+                return False
+            if tmp['Dynamic window [s]'] < 2*tmp['Tau min [s]']:
+                dialogWarning('Dynamic window shorter than two tau min!')
+                return False
+            if tmp['Dynamic step [s]'] <= 0:
+                dialogWarning('Dynamic step must be positive!')
+                return False
         
         # Check if mean frequency option is enabled
         if self._widgets['checkCentral'].isChecked():
-            tmp['Central frequency [Hz]'] = np.average(self._data['Frequency [Hz]'])
+            tmp['Central frequency [Hz]'] = np.average(self._data)
         
         self._params = tmp
 
+        return True
+
     def _clearDeviations(self):
 
         self._taus = [] # averaging times
         self._devs = {} # deviations
         self._conf_int = {} # confidence intervals
         self._noise_type = []
+        self._dynamic = None
 
     def analyse(self):
 
-        self.getParams() # already checks if data exists
+        if self._thread is not None:
+            dialogWarning('Analysis already running!')
+            return False
+
+        if not self.getParams(): # already checks if data exists
+            return False
 
         # Clear previous data
         self._clearDeviations()
 
-        # Generate taus
-        self._taus = np.linspace(
+        # Generate taus with unique integer strides
+        self._taus = fs.calc_tau_grid(
             self._params['Tau min [s]'],
             self._params['Tau max [s]'],
-            self._params['Tau N']
+            self._params['Sampling frequency [Hz]'],
+            mode=self._params['Tau grid'],
+            tau_N=self._params['Tau N']
         )
 
         # Clear plots
         self._widgets['canvasHist'].prepare_axes()
         self._widgets['canvasFreq'].prepare_axes()
         self._widgets['canvasDev'].prepare_axes(yLog=True, Grid=True)
+        self._widgets['canvasDyn'].prepare_axes(yLog=True)
 
-        # Plot frequency histogram
-        self.plotFrequencyHistogram()
-
-        # Calculate and plot fractional frequency
-        fs_frac = fs.calc_fractional_frequency(
-            self._data['Frequency [Hz]'],
-            self._params['Central frequency [Hz]']
+        # Reuse cumulative phase unless data or parameters changed
+        key = (
+            self._params['Central frequency [Hz]'],
+            self._params['Sampling frequency [Hz]'],
+            self._params['Float32']
         )
-        ts = np.arange(self._params['N']) / self._params['Sampling frequency [Hz]']
-        self.plotFractionalFrequency(ts, fs_frac)
-
-        # Calculate phase error
-        phase_error = fs.calc_phase_error(fs_frac, self._params['Sampling frequency [Hz]'])
-
-        # Calculate deviations
-        try:
-            if self._widgets['checkAllan'].isChecked():
-                self._devs['ADEV'] = calcDeviationProgress(
-                    dev='ADEV',
-                    parent=self,
-                    taus=self._taus,
-                    phase_error=phase_error,
-                    f_sampling=self._params['Sampling frequency [Hz]']
-                )
-            if self._widgets['checkAllanOvlp'].isChecked():
-                self._devs['ADEV ovlp'] = calcDeviationProgress(
-                    dev='ADEV ovlp',
-                    parent=self,
-                    taus=self._taus,
-                    phase_error=phase_error,
-                    f_sampling=self._params['Sampling frequency [Hz]']
-                )
-            if self._widgets['checkHadamard'].isChecked():
-                self._devs['HDEV'] = calcDeviationProgress(
-                    dev='HDEV',
-                    parent=self,
-                    taus=self._taus,
-                    phase_error=phase_error,
-                    f_sampling=self._params['Sampling frequency [Hz]']
-                )
-        except InterruptedError:
-            return False
-        
-        # Calculate noise types
-        alphas = fs.calc_noise_id(
-            self._data['Frequency [Hz]'],
+        if self._cum_phase_key != key:
+            self._cum_phase = None
+            self._envelope = None
+        self._cum_phase_key = key
+
+        # Run histogram, fractional frequency, plot envelope, deviations,
+        # noise types and confidence intervals in a worker thread
+        devs = [dev for dev, check in deviation_checks.items()
+                if self._widgets[check].isChecked()]
+        self._worker = AnalysisWorker(
+            self._data,
+            self._params,
             self._taus,
-            self._params['Sampling frequency [Hz]']
+            devs,
+            cum_phase=self._cum_phase,
+            envelope=self._envelope,
+            cache=self._dev_cache,
+            cache_key=(self._fingerprint,) + key
         )
-        self._noise_type = fs.dominant_noise(alphas)
+        self._thread = QThread()
+        self._worker.moveToThread(self._thread)
+
+        self._progress = DialogAnalysisProgress(self)
+        # lambda keeps the call in the GUI thread, worker thread is busy
+        self._progress.canceled.connect(lambda: self._worker.cancel())
+        self._worker.progress.connect(self._progress.updateProgress)
+        self._worker.partial.connect(self.plotDeviationPartial)
+
+        self._worker.finished.connect(self.analysisFinished)
+        self._worker.canceled.connect(self.analysisCanceled)
+        self._worker.failed.connect(self.analysisFailed)
+        for signal in (self._worker.finished, self._worker.canceled, self._worker.failed):
+            signal.connect(self._thread.quit)
+        self._thread.started.connect(self._worker.run)
+        self._thread.finished.connect(self._threadFinished)
+
+        self._widgets['btnAnalyse'].setEnabled(False)
+        self._thread.start()
 
-        # Calculate confidence intervals
-        if self._widgets['checkAllan'].isChecked():
-            self._conf_int['ADEV'] = fs.calc_confidence_interval(
-                self._devs['ADEV'],
-                self._taus,
-                self._params['Sampling frequency [Hz]'],
-                alphas,
-                self._params['N']
-            )
-        if self._widgets['checkAllanOvlp'].isChecked():
-            self._conf_int['ADEV ovlp'] = fs.calc_confidence_interval(
-                self._devs['ADEV ovlp'],
-                self._taus,
-                self._params['Sampling frequency [Hz]'],
-                alphas,
-                self._params['N']
-            )
-        if self._widgets['checkHadamard'].isChecked():
-            self._conf_int['HDEV'] = fs.calc_confidence_interval(
-                self._devs['HDEV'],
-                self._taus,
-                self._params['Sampling frequency [Hz]'],
-                alphas,
-                self._params['N']
-            )
+        return True
 
-        # Plot deviations
+    def analysisFinished(self, ret):
+
+        self._progress.close()
+
+        self._cum_phase = ret['cum_phase']
+        self._envelope = ret['envelope']
+        self._devs = ret['devs']
+        self._conf_int = ret['conf_int']
+        self._noise_type = ret['noise_type']
+        self._dynamic = ret['dynamic']
+        if ret['memory'] is not None:
+            for stage, peak in ret['memory'].items():
+                print('Peak memory of {}: {:.1f} MiB'.format(stage, peak / 2**20))
+
+        # Plot histogram, fractional frequency and deviations
+        self.plotFrequencyHistogram(*ret['histogram'])
+        self.plotFractionalFrequency(self._cum_phase, self._envelope)
+        self._widgets['canvasDev'].clear_progressive()
         self.plotDeviations()
+        if self._dynamic is not None:
+            self.plotDynamicDeviation()
 
         self.saveDeviations()
 
-        return True
+    def analysisCanceled(self):
 
-    def plotFrequencyHistogram(self):
+        self._progress.close()
+        self._clearDeviations()
+        self._keepPartialDeviations()
 
-        counts, bins = np.histogram(
-            self._data['Frequency [Hz]'],
-            100
-        )
+    def analysisFailed(self, msg):
+
+        self._progress.close()
+        self._clearDeviations()
+        self._keepPartialDeviations()
+        dialogWarning('Analysis failed: {}'.format(msg))
+
+    def _threadFinished(self):
+
+        self._thread.deleteLater()
+        self._worker.deleteLater()
+        self._thread = None
+        self._worker = None
+        self._widgets['btnAnalyse'].setEnabled(True)
+
+    def plotFrequencyHistogram(self, counts, bins):
 
         self._widgets['canvasHist'].histogram(counts, bins)
         self._widgets['canvasHist'].refresh()
 
-    def plotFractionalFrequency(self, ts, fs_frac):
+    def plotFractionalFrequency(self, cum_phase, envelope=None):
 
-        self._widgets['canvasFreq'].plot(ts, fs_frac)
+        self._widgets['canvasFreq'].plot_decimated(
+            cum_phase.fractional_frequency,
+            dx=1/cum_phase.f_sampling,
+            envelope=envelope
+        )
         self._widgets['canvasFreq'].refresh()
 
     def plotDeviations(self):
@@ -340,7 +407,7 @@ class FrequencyStability(QMainWindow):
             self._widgets['canvasDev'].errorbar(
                 self._taus,
                 value,
-                yerr=self._conf_int[key],
+                yerr=np.abs(self._conf_int[key] - value),
                 label=key,
                 fmt='o',
                 markersize=4
@@ -349,6 +416,42 @@ class FrequencyStability(QMainWindow):
         self._widgets['canvasDev'].add_legend()
         self._widgets['canvasDev'].refresh()
 
+    def plotDeviationPartial(self, dev, taus, values):
+
+        self._widgets['canvasDev'].plot_progressive(
+            taus,
+            values,
+            dev,
+            linestyle='',
+            marker='o',
+            markersize=4
+        )
+
+    def _keepPartialDeviations(self):
+
+        # deviations known before the analysis stopped stay visible
+        self._widgets['canvasDev'].clear_progressive(keep=True)
+        self._widgets['canvasDev'].add_legend()
+        self._widgets['canvasDev'].refresh()
+
+    def plotDynamicDeviation(self):
+
+        with np.errstate(invalid='ignore'):
+            valid = self._dynamic['adevs'][self._dynamic['adevs'] > 0]
+        if not valid.size:
+            return False
+
+        self._widgets['canvasDyn'].pcolormesh(
+            self._dynamic['times'],
+            self._taus,
+            self._dynamic['adevs'].T,
+            colorbar=True,
+            norm=colors.LogNorm(valid.min(), valid.max())
+        )
+        self._widgets['canvasDyn'].refresh()
+
+        return True
+
     def TauMinChanged(self):
 
         if self._widgets['checkTauMin'].isChecked():
@@ -369,7 +472,7 @@ class FrequencyStability(QMainWindow):
             self._widgets['checkTauMax'].setChecked(False)
             return False
         else:
-            N = self._data['Frequency [Hz]'].size
+            N = self._data.size
 
         if self._widgets['checkTauMax'].isChecked():
             try:
@@ -393,7 +496,8 @@ class FrequencyStability(QMainWindow):
         }
         for key, value in self._devs.items():
             data[key] = value
-            data['Confidence interval {}'.format(key)] = self._conf_int[key]
+            data['Lower bound {}'.format(key)] = self._conf_int[key][0]
+            data['Upper bound {}'.format(key)] = self._conf_int[key][1]
         data['Noise type'] = self._noise_type
 
         meta = {
@@ -415,8 +519,32 @@ class FrequencyStability(QMainWindow):
             msgBox.setIcon(QMessageBox.Question)
             ret = msgBox.exec()
 
-            if ret == QMessageBox.Yes:
-                save_csv(data, outputFilePath, meta)
+            if ret != QMessageBox.Yes:
+                return False
+
+        save_csv(data, outputFilePath, meta)
+        if self._dynamic is not None:
+            self.saveDynamicDeviation(outputFilePath)
+
+        return True
+
+    def saveDynamicDeviation(self, outputFilePath):
+        """Write dynamic Allan deviation as 2D array next to the deviations
+
+        Rows are windows with their centre time in the first column,
+        the other columns are taus.
+        """
+
+        path = os.path.splitext(outputFilePath)[0] + '_dynamic.csv'
+        header = ['Time [s] \\ Tau [s]'] + ['{:.6e}'.format(tau) for tau in self._taus]
+
+        np.savetxt(
+            path,
+            np.column_stack((self._dynamic['times'], self._dynamic['adevs'])),
+            delimiter=',',
+            header=','.join(header),
+            comments=''
+        )
 
         return True
     
@@ -5,6 +5,7 @@ from PyQt5.QtWidgets import (
     QPushButton,
     QLabel,
     QCheckBox,
+    QComboBox,
     QGridLayout,
     QHBoxLayout,
     QVBoxLayout,
@@ -31,6 +32,12 @@ def generate_widgets(widget_conf):
                 # QCheckBox
                 elif widget_type == 'QCheckBox':
                     tmp = QCheckBox()
+                # QComboBox
+                elif widget_type == 'QComboBox':
+                    tmp = QComboBox()
+                    tmp.addItems(widget['items'])
+                    if 'default' in widget.keys():
+                        tmp.setCurrentText(widget['default'])
                 # PlotCanvas
                 elif widget_type == 'PlotCanvas':
                     tmp = PlotCanvas(
@@ -1,8 +1,23 @@
 # -*- coding: utf-8 -*-
 
+import math
+from collections import OrderedDict
+from multiprocessing import Pool, shared_memory
+
 import numpy as np
 
 
+stride_tol = 1e-6 # samples, absorbs rounding of tau * f_sampling
+tau_grid_modes = ('linear', 'octave', 'decade', 'all')
+theo1_rtol = 1e-9 # accepted rounding error of the FFT Theo1 kernel, else direct sum
+theo1_block = 2**12 # minimal window positions per block of the FFT Theo1 kernel
+theoh_switch = 0.1 # fraction of record length above which TheoH uses Theo1
+theoh_max_window = 2**16 # samples, TheoH decimates the phase above this Theo1 window
+histogram_chunk = 2**20 # samples binned at once by calc_histogram
+histogram_oversampling = 16 # fine bins per bin of an adaptive histogram, merged within about 15 %
+cumulative_phase_chunk = 2**20 # samples accumulated at once by CumulativePhase
+phase_checkpoint = 2**16 # samples between float64 phase checkpoints of float32 storage
+
 # ----- Misc -----
 def calc_fractional_frequency(fs, f0):
 
@@ -22,20 +37,28 @@ def calc_phase_error(fs_frac, f_sampling):
 
     return ret
 
+def calc_block_avg(arr, n):
+    """Averages of consecutive non-overlapping blocks of n samples
+
+    arr may be a CumulativePhase, then the averages are read from it.
+    """
+
+    if isinstance(arr, CumulativePhase):
+        return arr.block_avg(n)
+
+    x = np.asarray(arr)
+    loop_count = x.size // n
+
+    ret = x[:loop_count*n].reshape(loop_count, n).mean(axis=1)
+
+    return ret
+
 def calc_array_avg(arr, tau, f_sampling):
 
     n = tau * f_sampling # averaging factor
-    n = int(np.floor(n)) + 1
-    loop_count = arr.size / n
-    loop_count = int(np.floor(loop_count))
-
-    ret = []
-    iter = 0
-    for _ in range(loop_count):
-        ret.append(np.average(arr[iter:iter+n]))
-        iter += n
+    n = int(np.floor(n + stride_tol)) + 1
 
-    return np.array(ret)
+    return calc_block_avg(arr, n)
 
 def calc_array_diff(arr):
 
@@ -44,49 +67,441 @@ def calc_array_diff(arr):
 
     return ret
 
+# ----- Cumulative phase -----
+class CumulativePhase:
+    """Cumulative sum of fractional frequency, i.e. the phase error
+
+    Built once per data set. The cumulative sum is the phase error,
+    so deviations, noise identification and plotting share one buffer
+    instead of reprocessing all N samples, and averages over blocks of n
+    samples cost O(N/n) on demand.
+
+    With float64 storage the sum is accumulated chunk by chunk into one
+    preallocated buffer with the running total carried between chunks,
+    which gives the same values as a single np.cumsum.
+
+    With float32 storage the fractional frequency itself is stored, its
+    rounding is relative to the frequency and not to the phase, which
+    grows along the record. Every phase_checkpoint samples the phase is
+    kept in float64, summed per chunk in float64 with a compensated
+    carry, and phase_error rebuilds the phase in float64 from the nearest
+    checkpoint on demand. That halves the memory of the data set.
+
+    Parameters
+    ------
+    fs_frac : fractional frequency
+    f_sampling : sampling frequency [Hz]
+    dtype : storage, np.float64 or np.float32
+    chunk_size : samples accumulated at once
+    """
+
+    def __init__(self, fs_frac, f_sampling, dtype=np.float64, chunk_size=cumulative_phase_chunk):
+
+        x = np.asarray(fs_frac)
+
+        self._build(
+            (x[i:i+chunk_size] for i in range(0, x.size, chunk_size)),
+            x.size,
+            f_sampling,
+            dtype,
+            chunk_size
+        )
+
+    @classmethod
+    def from_frequency(cls, freqs, f0, f_sampling, dtype=np.float64, chunk_size=cumulative_phase_chunk):
+        """Cumulative phase straight from frequencies [Hz], e.g. a memory-mapped file
+
+        Fractional frequency only exists chunk by chunk, so besides the
+        phase itself memory is bounded by chunk_size samples.
+        """
+
+        ret = cls.__new__(cls)
+        ret._build(
+            (calc_fractional_frequency(freqs[i:i+chunk_size], f0)
+             for i in range(0, freqs.size, chunk_size)),
+            freqs.size,
+            f_sampling,
+            dtype,
+            chunk_size
+        )
+
+        return ret
+
+    @classmethod
+    def _from_storage(cls, frac, checkpoints, f_sampling):
+        # float32 cumulative phase around existing arrays, e.g. shared memory
+
+        ret = cls.__new__(cls)
+        ret.size = frac.size
+        ret.f_sampling = f_sampling
+        ret.dtype = frac.dtype
+        ret._csum = None
+        ret._frac = frac
+        ret._checkpoints = checkpoints
+
+        return ret
+
+    def _build(self, blocks, size, f_sampling, dtype, chunk_size):
+
+        self.size = size
+        self.f_sampling = f_sampling
+        self.dtype = np.dtype(dtype)
+        if self.dtype not in (np.float64, np.float32):
+            raise ValueError('Unsupported storage type {}!'.format(self.dtype))
+
+        buf = np.empty(min(chunk_size, self.size))
+        if self.dtype == np.float64:
+            # cumulative sum with leading zero, in phase units
+            self._csum = np.zeros(self.size + 1)
+            carry = 0.
+            start = 1
+            for block in blocks:
+                tmp = buf[:block.size]
+                tmp[:] = block
+                # carry in the first term keeps the sum sequential as in np.cumsum
+                tmp[0] += carry
+                np.cumsum(tmp, out=tmp)
+                carry = tmp[-1]
+                np.divide(tmp, f_sampling, out=self._csum[start:start+tmp.size])
+                start += tmp.size
+            return
+
+        self._csum = None
+        self._frac = np.empty(self.size, dtype=self.dtype)
+        # phase at samples 0, B, 2B, ... of the cumulative sum with leading zero
+        self._checkpoints = np.zeros(self.size // phase_checkpoint + 1)
+        hi, lo = 0., 0. # running sum of the stored values, hi + lo
+        start = 0
+        for block in blocks:
+            stored = self._frac[start:start+block.size]
+            stored[:] = block
+            tmp = buf[:block.size]
+            np.cumsum(stored, dtype=np.float64, out=tmp)
+            # checkpoints inside the chunk, sum of the stored values before them
+            idx = np.arange(-(-(start + 1) // phase_checkpoint), (start + tmp.size) // phase_checkpoint + 1)
+            self._checkpoints[idx] = (hi + (lo + tmp[idx*phase_checkpoint - start - 1])) / f_sampling
+            # TwoSum keeps the rounding error of the carry
+            s = hi + tmp[-1]
+            bp = s - hi
+            lo += (hi - (s - bp)) + (tmp[-1] - bp)
+            hi = s
+            start += tmp.size
+
+    @property
+    def nbytes(self):
+        """Memory held by the cumulative sum, or fractional frequency and checkpoints"""
+
+        if self._csum is not None:
+            return self._csum.nbytes
+
+        return self._frac.nbytes + self._checkpoints.nbytes
+
+    @property
+    def fractional_frequency(self):
+        """Lazy fractional frequency, slices are computed on demand"""
+
+        return FractionalFrequencyView(self)
+
+    @property
+    def phase_error(self):
+        """Phase error, same as calc_phase_error(fs_frac, f_sampling)
+
+        A PhaseErrorView rebuilding float64 slices with float32 storage.
+        """
+
+        if self._csum is not None:
+            return self._csum[1:]
+
+        return PhaseErrorView(self)
+
+    def _calc_csum(self, start, stop):
+        # Cumulative sum with leading zero [start, stop) in float64
+
+        if self._csum is not None:
+            return self._csum[start:stop]
+
+        stop = min(stop, self.size + 1)
+        if stop <= start:
+            return np.zeros(0)
+
+        # exclusive sums within every checkpoint interval, plus its checkpoint
+        first = start // phase_checkpoint
+        blocks = (stop - 1) // phase_checkpoint - first + 1
+        offset = first * phase_checkpoint
+        ret = np.zeros((blocks, phase_checkpoint))
+        tmp = ret.reshape(-1)
+        tmp[1:stop-offset] = self._frac[offset:stop-1]
+        tmp[::phase_checkpoint] = 0.
+        np.cumsum(ret, axis=1, out=ret)
+        ret /= self.f_sampling
+        ret += self._checkpoints[first:first+blocks, None]
+
+        return tmp[start-offset:stop-offset]
+
+    def _calc_avg(self, n, start=0, stop=None):
+
+        if self._csum is not None:
+            ret = np.diff(self._csum[start:stop][::n])
+            ret *= self.f_sampling/n
+
+            return ret
+
+        # block sums of the stored values, numpy casts to float64 in small buffers
+        stop = self.size + 1 if stop is None else min(stop, self.size + 1)
+        count = max(stop - 1 - start, 0) // n
+        ret = self._frac[start:start+count*n].reshape(count, n).sum(axis=1, dtype=np.float64)
+        ret /= n
+
+        return ret
+
+    def block_avg(self, n):
+        """Averages of consecutive non-overlapping blocks of n samples, O(N/n)"""
+
+        return self._calc_avg(n)
+
+class FractionalFrequencyView:
+    """Fractional frequency of a CumulativePhase without a full copy
+
+    Supports size, len and slicing, every slice is computed from the
+    cumulative sum, so plots read any range in memory of that range.
+    """
+
+    def __init__(self, cum_phase):
+
+        self._cum_phase = cum_phase
+        self.size = cum_phase.size
+        self.dtype = np.dtype(np.float64)
+
+    def __len__(self):
+
+        return self.size
+
+    def __getitem__(self, key):
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step < 0 or stop <= start:
+                return np.asarray(self)[key]
+            return self._cum_phase._calc_avg(1, start, stop + 1)[::step]
+
+        i = range(self.size)[key]
+
+        return self._cum_phase._calc_avg(1, i, i + 2)[0]
+
+    def __array__(self, dtype=None, copy=None):
+
+        ret = self._cum_phase._calc_avg(1)
+
+        return ret if dtype is None else ret.astype(dtype, copy=False)
+
+class PhaseErrorView:
+    """Phase error of a float32 CumulativePhase without a full copy
+
+    Slices are rebuilt in float64 from the nearest checkpoint, so chunked
+    deviation kernels read the phase in memory of one chunk. Kernels
+    which cannot be chunked (MDEV, TDEV, TOTDEV) and dynamic ADEV convert
+    it with np.asarray, which holds a full float64 copy while they run.
+    """
+
+    def __init__(self, cum_phase):
+
+        self._cum_phase = cum_phase
+        self.size = cum_phase.size
+        self.dtype = np.dtype(np.float64)
+
+    def __len__(self):
+
+        return self.size
+
+    def __getitem__(self, key):
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step < 0 or stop <= start:
+                return np.asarray(self)[key]
+            return self._cum_phase._calc_csum(start + 1, stop + 1)[::step]
+
+        i = range(self.size)[key]
+
+        return self._cum_phase._calc_csum(i + 1, i + 2)[0]
+
+    def __array__(self, dtype=None, copy=None):
+
+        ret = self._cum_phase._calc_csum(1, self.size + 1)
+
+        return ret if dtype is None else ret.astype(dtype, copy=False)
+
 # ----- Deviations -----
-def calc_ADEV_single(phase_error, tau):
+def calc_second_diff(phase_error, n):
+    """Second differences x[i+2n] - 2x[i+n] + x[i] for all i in one pass
 
-    N = phase_error.size
+    Parameters
+    ------
+    phase_error : phase samples
+    n : int, stride in samples
+    """
 
-    ret = 0
-    for i in range(N-2):
-        tmp = phase_error[i+2]
-        tmp -= 2*phase_error[i+1]
-        tmp += phase_error[i]
+    x = np.asarray(phase_error)
+    M = max(x.size - 2*n, 0) # number of differences
+
+    ret = np.add(x[2*n:2*n+M], x[:M], dtype=np.float64)
+    ret -= x[n:n+M]
+    ret -= x[n:n+M]
+
+    return ret
+
+def calc_ADEV_sumsq(phase_error, n):
+    """Sum of squared second differences and their count for ADEV
+
+    Phase is decimated to every n-th sample with a strided view, so only
+    N/n differences are evaluated.
+    """
+
+    n = max(n, 1) # stride 0 degenerates to adjacent samples
+    x = np.asarray(phase_error)[::n]
+
+    tmp = calc_second_diff(x, 1)
+    ret = np.dot(tmp, tmp)
+
+    return ret, tmp.size
+
+def calc_ADEV_overlapped_sumsq(phase_error, n):
+    """Sum of squared second differences and their count for overlapped ADEV"""
+
+    tmp = calc_second_diff(phase_error, n)
+    ret = np.dot(tmp, tmp)
+
+    return ret, tmp.size
+
+def calc_third_diff(phase_error, n):
+    """Third differences x[i+3n] - 3x[i+2n] + 3x[i+n] - x[i] for all i in one pass
+
+    Parameters
+    ------
+    phase_error : phase samples
+    n : int, stride in samples
+    """
+
+    x = np.asarray(phase_error)
+    M = max(x.size - 3*n, 0) # number of differences
+
+    ret = np.subtract(x[n:n+M], x[2*n:2*n+M], dtype=np.float64)
+    ret *= 3
+    ret += x[3*n:3*n+M]
+    ret -= x[:M]
+
+    return ret
+
+def calc_HDEV_sumsq(phase_error, n):
+    """Sum of squared third differences and their count for HDEV"""
+
+    tmp = calc_third_diff(phase_error, n)
+    ret = np.dot(tmp, tmp)
+
+    return ret, tmp.size
+
+def calc_HDEV_nonoverlapped_sumsq(phase_error, n):
+    """Sum of squared third differences and their count for non-overlapped HDEV
+
+    Phase is decimated to every n-th sample with a strided view, so only
+    N/n differences are evaluated.
+    """
+
+    n = max(n, 1) # stride 0 degenerates to adjacent samples
+    x = np.asarray(phase_error)[::n]
+
+    tmp = calc_third_diff(x, 1)
+    ret = np.dot(tmp, tmp)
+
+    return ret, tmp.size
 
-        ret += np.power(tmp, 2)
+def calc_MDEV_sumsq(phase_error, n):
+    """Sum of squared phase-averaged second differences for MDEV and TDEV
 
-    ret /= (2*(N - 2)*np.power(tau, 2))
+    The sum of n second differences starting at j is P[j+n] - P[j] of the
+    prefix sum P of the stride-n second differences, so every stride
+    costs O(N). The second differences are small and about zero-mean, so
+    P stays small even for random walk FM. Count is multiplied by n^2.
+    """
+
+    n = max(n, 1) # stride 0 degenerates to adjacent samples
+
+    tmp = calc_second_diff(phase_error, n)
+    P = np.zeros(tmp.size + 1)
+    np.cumsum(tmp, out=P[1:])
+    del tmp
+
+    tmp = P[n:] - P[:max(P.size - n, 0)]
+    ret = np.dot(tmp, tmp)
+
+    return ret, tmp.size * n**2
+
+def calc_TOTDEV_sumsq(phase_error, n):
+    """Sum of squared second differences of the reflection-extended phase
+
+    The phase is extended at both ends by x[-j] = 2x[0] - x[j] and
+    x[N-1+j] = 2x[N-1] - x[N-1-j]. Centers 1..N-2 are split into at most
+    three ranges with fixed reflection state, whose neighbours are read as
+    (reversed) views of x, so no extended copy is built.
+    """
+
+    n = max(n, 1) # stride 0 degenerates to adjacent samples
+    x = np.asarray(phase_error)
+    N = x.size
+    if n > N - 1: # reflection does not reach this far
+        return 0., 0
+
+    ret = 0.
+    bounds = sorted({1, max(min(n, N - 1), 1), max(min(N - n, N - 1), 1), N - 1})
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        if a >= b:
+            continue
+
+        tmp = np.multiply(x[a:b], -2, dtype=np.float64)
+        if a >= n: # x[i-n]
+            tmp += x[a-n:b-n]
+        else: # 2x[0] - x[n-i]
+            tmp += 2 * x[0]
+            tmp -= x[n-b+1:n-a+1][::-1]
+        if b + n <= N: # x[i+n]
+            tmp += x[a+n:b+n]
+        else: # 2x[N-1] - x[2N-2-i-n]
+            tmp += 2 * x[N-1]
+            tmp -= x[2*N-1-n-b:2*N-1-n-a][::-1]
+        ret += np.dot(tmp, tmp)
+
+    return ret, N - 2
+
+def calc_ADEV_single(phase_error, tau, f_sampling):
+
+    n = tau * f_sampling # averaging factor
+    n = int(np.floor(n + stride_tol))
+
+    ret, count = calc_ADEV_sumsq(phase_error, n)
+
+    ret /= (2*count*np.power(tau, 2))
     ret = np.sqrt(ret)
 
     return ret
 
-def calc_ADEV(phase_error, taus):
+def calc_ADEV(phase_error, taus, f_sampling):
 
     ret = []
     print('Calculating Allan deviation...')
     for tau in taus:
-        ret.append(calc_ADEV_single(phase_error, tau))
+        ret.append(calc_ADEV_single(phase_error, tau, f_sampling))
 
 
     return np.array(ret)
 
 def calc_ADEV_overlapped_single(phase_error, tau, f_sampling):
 
-    N = phase_error.size
     n = tau * f_sampling # averaging factor
-    n = int(np.floor(n))
+    n = int(np.floor(n + stride_tol))
 
-    ret = 0
-    for i in range(N - 2*n):
-        tmp = phase_error[i + 2*n]
-        tmp -= 2*phase_error[i+n]
-        tmp += phase_error[i]
-
-        ret += np.power(tmp, 2)
+    ret, count = calc_ADEV_overlapped_sumsq(phase_error, n)
 
-    ret /= (2*(N - 2*n)*np.power(tau, 2))
+    ret /= (2*count*np.power(tau, 2))
     ret = np.sqrt(ret)
 
     return ret
@@ -103,20 +518,12 @@ def calc_ADEV_overlapped(phase_error, taus, f_sampling):
 
 def calc_HDEV_single(phase_error, tau, f_sampling):
 
-    N = phase_error.size
     n = tau * f_sampling # averaging factor
-    n = int(np.floor(n))
-
-    ret = 0
-    for i in range(N - 3*n):
-        tmp = phase_error[i + 3*n]
-        tmp -= 3*phase_error[i+2*n]
-        tmp += 3*phase_error[i+n]
-        tmp -= phase_error[i]
+    n = int(np.floor(n + stride_tol))
 
-        ret += np.power(tmp, 2)
+    ret, count = calc_HDEV_sumsq(phase_error, n)
 
-    ret /= (6*(N - 3*n)*np.power(tau, 2))
+    ret /= (6*count*np.power(tau, 2))
     ret = np.sqrt(ret)
 
     return ret
@@ -130,20 +537,1003 @@ def calc_HDEV(phase_error, taus, f_sampling):
 
     return np.array(ret)
 
+def calc_HDEV_nonoverlapped_single(phase_error, tau, f_sampling):
+
+    n = tau * f_sampling # averaging factor
+    n = int(np.floor(n + stride_tol))
+
+    ret, count = calc_HDEV_nonoverlapped_sumsq(phase_error, n)
+
+    ret /= (6*count*np.power(tau, 2))
+    ret = np.sqrt(ret)
+
+    return ret
+
+def calc_HDEV_nonoverlapped(phase_error, taus, f_sampling):
+
+    ret = []
+    print('Calculating non-overlapped Hadamard deviation...')
+    for tau in taus:
+        ret.append(calc_HDEV_nonoverlapped_single(phase_error, tau, f_sampling))
+
+    return np.array(ret)
+
+def calc_MDEV_single(phase_error, tau, f_sampling):
+
+    n = tau * f_sampling # averaging factor
+    n = int(np.floor(n + stride_tol))
+
+    ret, count = calc_MDEV_sumsq(phase_error, n)
+
+    ret /= (2*count*np.power(tau, 2))
+    ret = np.sqrt(ret)
+
+    return ret
+
+def calc_MDEV(phase_error, taus, f_sampling):
+
+    ret = []
+    print('Calculating modified Allan deviation...')
+    for tau in taus:
+        ret.append(calc_MDEV_single(phase_error, tau, f_sampling))
+
+    return np.array(ret)
+
+def calc_TDEV_single(phase_error, tau, f_sampling):
+
+    n = tau * f_sampling # averaging factor
+    n = int(np.floor(n + stride_tol))
+
+    ret, count = calc_MDEV_sumsq(phase_error, n)
+
+    ret /= (6*count)
+    ret = np.sqrt(ret)
+
+    return ret
+
+def calc_TDEV(phase_error, taus, f_sampling):
+
+    ret = []
+    print('Calculating time deviation...')
+    for tau in taus:
+        ret.append(calc_TDEV_single(phase_error, tau, f_sampling))
+
+    return np.array(ret)
+
+def calc_TOTDEV_single(phase_error, tau, f_sampling):
+
+    n = tau * f_sampling # averaging factor
+    n = int(np.floor(n + stride_tol))
+
+    ret, count = calc_TOTDEV_sumsq(phase_error, n)
+
+    ret /= (2*count*np.power(tau, 2))
+    ret = np.sqrt(ret)
+
+    return ret
+
+def calc_TOTDEV(phase_error, taus, f_sampling):
+
+    ret = []
+    print('Calculating total deviation...')
+    for tau in taus:
+        ret.append(calc_TOTDEV_single(phase_error, tau, f_sampling))
+
+    return np.array(ret)
+
+# ----- Result cache -----
+class DeviationCache:
+    """Least recently used cache of per-stride results
+
+    Keys are tuples of data set identification, central and sampling
+    frequency followed by (deviation name, stride); values are
+    (sum of squares, count) for deviations and noise types for
+    'Noise ID'.
+
+    Parameters
+    ------
+    max_entries : entries kept before the least recently used are evicted
+    """
+
+    def __init__(self, max_entries=100000):
+
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+
+    def __contains__(self, key):
+
+        return key in self._entries
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def get(self, key):
+
+        if key not in self._entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+
+        return self._entries[key]
+
+    def put(self, key, value):
+
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+
+        self._entries.clear()
+
+# ----- Batched deviations -----
+# deviation name: kernel returning (sum of squares, count), deviation is
+# sqrt(sum / (norm * count * tau^tau_power)); kernel terms span
+# span*stride samples (None if it cannot be split into chunks) and
+# decimated kernels only read every stride-th sample
+deviation_kernels = {
+    'ADEV': {'sumsq': calc_ADEV_sumsq, 'norm': 2, 'tau_power': 2, 'span': 2, 'decimated': True},
+    'ADEV ovlp': {'sumsq': calc_ADEV_overlapped_sumsq, 'norm': 2, 'tau_power': 2, 'span': 2, 'decimated': False},
+    'HDEV': {'sumsq': calc_HDEV_sumsq, 'norm': 6, 'tau_power': 2, 'span': 3, 'decimated': False},
+    'HDEV non-ovlp': {'sumsq': calc_HDEV_nonoverlapped_sumsq, 'norm': 6, 'tau_power': 2, 'span': 3, 'decimated': True},
+    'MDEV': {'sumsq': calc_MDEV_sumsq, 'norm': 2, 'tau_power': 2, 'span': None, 'decimated': False},
+    'TDEV': {'sumsq': calc_MDEV_sumsq, 'norm': 6, 'tau_power': 0, 'span': None, 'decimated': False},
+    'TOTDEV': {'sumsq': calc_TOTDEV_sumsq, 'norm': 2, 'tau_power': 2, 'span': None, 'decimated': False}
+}
+
+def calc_deviation_from_sumsq(dev, sums, counts, taus):
+    """Deviation from kernel sums of squares and counts"""
+
+    kernel = deviation_kernels[dev]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = sums / (kernel['norm']*counts*np.power(taus, kernel['tau_power']))
+        ret = np.sqrt(ret)
+
+    return ret
+
+def calc_strides(taus, f_sampling):
+    """Integer strides for given taus
+
+    Returns
+    ------
+    strides : unique strides in ascending order
+    inverse : index into strides for every tau
+    """
+
+    ns = np.floor(np.asarray(taus) * f_sampling + stride_tol).astype(np.int64)
+    strides, inverse = np.unique(ns, return_inverse=True)
+
+    return strides, inverse.reshape(-1)
+
+def calc_tau_grid(tau_min, tau_max, f_sampling, mode='linear', tau_N=20):
+    """Averaging times with unique integer strides
+
+    Parameters
+    ------
+    tau_min, tau_max : range of averaging times [s]
+    f_sampling : sampling frequency [Hz]
+    mode : one of tau_grid_modes
+        linear - tau_N evenly spaced taus
+        octave - strides doubling from tau_min
+        decade - tau_N log-spaced taus per decade
+        all - every stride between tau_min and tau_max
+    tau_N : number of taus (linear) or taus per decade (decade)
+
+    Returns
+    ------
+    Averaging times stride/f_sampling, duplicate strides removed
+    """
+
+    n_min = max(int(np.floor(tau_min * f_sampling + stride_tol)), 1)
+    n_max = int(np.floor(tau_max * f_sampling + stride_tol))
+    if n_max < n_min:
+        raise ValueError('Tau max {} s is below one sample or tau min!'.format(tau_max))
+
+    if mode == 'linear':
+        ns = np.linspace(tau_min, tau_max, tau_N) * f_sampling
+        ns = np.floor(ns + stride_tol)
+    elif mode == 'octave':
+        k_max = int(np.floor(np.log2(n_max / n_min)))
+        ns = n_min * np.power(2, np.arange(k_max + 1))
+    elif mode == 'decade':
+        decades = np.log10(n_max / n_min)
+        ns = np.logspace(
+            np.log10(n_min),
+            np.log10(n_max),
+            int(np.ceil(decades * tau_N)) + 1
+        )
+        ns = np.floor(ns + stride_tol)
+    elif mode == 'all':
+        ns = np.arange(n_min, n_max + 1)
+    else:
+        raise ValueError('Unknown tau grid mode {}!'.format(mode))
+
+    ns = np.clip(ns, n_min, n_max).astype(np.int64)
+    ret = np.unique(ns) / f_sampling
+
+    return ret
+
+def calc_chunks(N, n, dev, chunk_size=None):
+    """Split the phase of a deviation kernel into overlapping chunks
+
+    Chunks overlap by the difference span, so summing the kernel over all
+    chunks equals a single call over the whole array.
+
+    Returns
+    ------
+    List of (start, stop, work), kernel reads phase_error[start:stop] and
+    work is the number of samples the chunk costs
+    """
+
+    span = deviation_kernels[dev]['span']
+    decimated = deviation_kernels[dev]['decimated']
+
+    # decimated kernels need chunks aligned to the stride
+    step = max(n, 1) if decimated else 1
+    if chunk_size is None or span is None:
+        L = max(N, 1)
+    else:
+        L = max(chunk_size // step, 1) * step
+    margin = 0 if span is None else span * (step if decimated else n)
+
+    ret = []
+    for start in range(0, N, L):
+        ret.append((start, min(start + L + margin, N), (min(start + L, N) - start) / step))
+
+    return ret
+
+def calc_sumsq_chunked(phase_error, n, dev, chunk_size=None, callback=None):
+    """Sum of squares and count of a deviation kernel over chunks of phase
+
+    Parameters
+    ------
+    phase_error : phase samples
+    n : int, stride in samples
+    dev : name of deviation, key of deviation_kernels
+    chunk_size : samples per chunk, whole array if None
+    callback : callable(work) called after every chunk with the number of
+        samples it cost, may raise to abort the calculation
+    """
+
+    kernel = deviation_kernels[dev]['sumsq']
+    x = phase_error if isinstance(phase_error, PhaseErrorView) else np.asarray(phase_error)
+
+    ret = 0
+    count = 0
+    for start, stop, work in calc_chunks(x.size, n, dev, chunk_size):
+        tmp, tmp_count = kernel(x[start:stop], n)
+        ret += tmp
+        count += tmp_count
+
+        if callback is not None:
+            callback(work)
+
+    return ret, count
+
+def calc_deviation_cost(N, n, dev):
+    """Number of phase samples a deviation kernel reads for stride n"""
+
+    if deviation_kernels[dev]['decimated']:
+        return N / max(n, 1)
+
+    return N
+
+def calc_deviations(phase_error, taus, f_sampling, devs=tuple(deviation_kernels), callback=None, chunk_size=None, workers=None, cache=None, key=(), result_callback=None):
+    """Calculate several deviations for all taus in one pass
+
+    Integer strides are worked out once and every requested deviation is
+    evaluated once per unique stride.
+
+    Parameters
+    ------
+    phase_error : phase samples or PhaseErrorView, which is read chunk by
+        chunk
+    taus : averaging times [s]
+    f_sampling : sampling frequency [Hz]
+    devs : names of deviations, keys of deviation_kernels
+    callback : callable(done, total) reporting progress in samples read,
+        may raise to abort the calculation
+    chunk_size : samples per kernel call, progress is reported (and may be
+        aborted) after every chunk; whole array if None
+    workers : number of worker processes, serial calculation if None or 1
+    cache : DeviationCache, only (deviation, stride) pairs missing from it
+        are calculated
+    key : tuple identifying data set and parameters in cache
+    result_callback : callable(dev, indices, deviations) called as soon as
+        a deviation is known at the taus[indices] sharing one stride
+
+    Returns
+    ------
+    Structured array with 'Tau [s]' field and one field per deviation
+    """
+
+    for dev in devs:
+        if dev not in deviation_kernels:
+            raise ValueError('Unknown deviation type {}!'.format(dev))
+
+    x = phase_error if isinstance(phase_error, PhaseErrorView) else np.asarray(phase_error)
+    taus = np.asarray(taus, dtype=float)
+    strides, inverse = calc_strides(taus, f_sampling)
+
+    def publish(dev, n, value):
+        if result_callback is not None:
+            idx = np.flatnonzero(strides[inverse] == n)
+            result_callback(dev, idx, calc_deviation_from_sumsq(dev, value[0], value[1], taus[idx]))
+
+    # (deviation, stride) pairs which have to be calculated
+    results = {}
+    pairs = []
+    for n in strides:
+        for dev in devs:
+            n = int(n)
+            tmp = None if cache is None else cache.get(key + (dev, n))
+            if tmp is None:
+                pairs.append((dev, n))
+            else:
+                results[(dev, n)] = tmp
+                publish(dev, n, tmp)
+
+    total = sum(calc_deviation_cost(x.size, n, dev) for dev, n in pairs)
+    done = 0
+
+    def progress(work):
+        nonlocal done
+        done += work
+        if callback is not None:
+            callback(done, total)
+
+    if workers is not None and workers > 1 and pairs:
+        results.update(calc_sumsq_parallel(
+            x, pairs, workers,
+            chunk_size=chunk_size,
+            callback=progress,
+            result_callback=publish
+        ))
+    else:
+        for dev, n in pairs:
+            results[(dev, n)] = calc_sumsq_chunked(
+                x, n, dev,
+                chunk_size=chunk_size,
+                callback=progress
+            )
+            publish(dev, n, results[(dev, n)])
+
+    if cache is not None:
+        for dev, n in pairs:
+            cache.put(key + (dev, n), results[(dev, n)])
+
+    ret = np.zeros(
+        taus.size,
+        dtype=[('Tau [s]', float)] + [(dev, float) for dev in devs]
+    )
+    ret['Tau [s]'] = taus
+    for dev in devs:
+        sums = np.array([results[(dev, int(n))][0] for n in strides])
+        counts = np.array([results[(dev, int(n))][1] for n in strides])
+
+        ret[dev] = calc_deviation_from_sumsq(dev, sums[inverse], counts[inverse], taus)
+
+    return ret
+
+# ----- Parallel deviations -----
+parallel_chunk_size = 2**22 # samples per task sent to a worker process
+
+_shared_mem = None
+_shared_phase = None
+
+def _init_shared_phase(name, layout, f_sampling=None):
+    # Pool initializer, maps the arrays published by calc_sumsq_parallel,
+    # the phase or with f_sampling float32 fractional frequency and checkpoints
+
+    global _shared_mem, _shared_phase
+
+    _shared_mem = shared_memory.SharedMemory(name=name)
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=_shared_mem.buf, offset=offset)
+              for offset, shape, dtype in layout]
+    if f_sampling is None:
+        _shared_phase = arrays[0]
+    else:
+        _shared_phase = CumulativePhase._from_storage(*arrays, f_sampling).phase_error
+
+def _calc_sumsq_task(task):
+
+    dev, n, start, stop, work = task
+    tmp, count = deviation_kernels[dev]['sumsq'](_shared_phase[start:stop], n)
+
+    return dev, n, tmp, count, work
+
+def calc_sumsq_parallel(phase_error, pairs, workers, chunk_size=None, callback=None, result_callback=None):
+    """Sums of squares and counts of deviation kernels on a process pool
+
+    The phase is copied once into shared memory, every (deviation, stride)
+    is split into chunks and partial sums from the workers are merged.
+    A PhaseErrorView shares its float32 storage and checkpoints instead.
+
+    Parameters
+    ------
+    phase_error : phase samples or PhaseErrorView
+    pairs : list of (deviation name, stride)
+    workers : number of worker processes
+    chunk_size : samples per task, parallel_chunk_size if None
+    callback : callable(work) called after every finished task, may raise
+        to abort the calculation
+    result_callback : callable(dev, n, (sum of squares, count)) called
+        once all chunks of a pair are merged
+
+    Returns
+    ------
+    dict {(deviation name, stride): (sum of squares, count)}
+    """
+
+    if chunk_size is None:
+        chunk_size = parallel_chunk_size
+
+    if isinstance(phase_error, PhaseErrorView):
+        x = phase_error
+        cum_phase = phase_error._cum_phase
+        arrays = (cum_phase._frac, cum_phase._checkpoints)
+        f_sampling = cum_phase.f_sampling
+    else:
+        x = np.asarray(phase_error, dtype=float)
+        arrays = (x,)
+        f_sampling = None
+
+    # Largest strides first, they are the slowest overlapping tasks
+    tasks = []
+    for dev, n in sorted(pairs, key=lambda pair: -pair[1]):
+        for start, stop, work in calc_chunks(x.size, n, dev, chunk_size):
+            tasks.append((dev, n, start, stop, work))
+
+    ret = {pair: (0, 0) for pair in pairs}
+    remaining = dict.fromkeys(pairs, 0) # unfinished tasks per pair
+    for dev, n, _, _, _ in tasks:
+        remaining[(dev, n)] += 1
+
+    # arrays one after another, offsets aligned to 8 bytes
+    layout = []
+    size = 0
+    for arr in arrays:
+        layout.append((size, arr.shape, arr.dtype))
+        size += -(-arr.nbytes // 8) * 8
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        for arr, (offset, shape, dtype) in zip(arrays, layout):
+            tmp = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            tmp[:] = arr
+            del tmp
+
+        with Pool(workers, initializer=_init_shared_phase, initargs=(shm.name, layout, f_sampling)) as pool:
+            for dev, n, tmp, count, work in pool.imap_unordered(_calc_sumsq_task, tasks):
+                ret[(dev, n)] = (ret[(dev, n)][0] + tmp, ret[(dev, n)][1] + count)
+
+                remaining[(dev, n)] -= 1
+                if result_callback is not None and remaining[(dev, n)] == 0:
+                    result_callback(dev, n, ret[(dev, n)])
+                if callback is not None:
+                    callback(work)
+    finally:
+        shm.close()
+        shm.unlink()
+
+    return ret
+
+# ----- Streaming deviations -----
+class DeviationAccumulator:
+    """Running deviations of a frequency record received in blocks
+
+    Keeps the running phase, the last span*n_max phase samples and the
+    sums of squared differences per deviation and stride, so every block
+    costs O(block size x number of taus) and the full record is never
+    stored.
+
+    Parameters
+    ------
+    f0 : central frequency [Hz]
+    f_sampling : sampling frequency [Hz]
+    taus : averaging times [s]
+    devs : names of deviations, keys of deviation_kernels
+    """
+
+    def __init__(self, f0, f_sampling, taus, devs=tuple(deviation_kernels)):
+
+        for dev in devs:
+            if dev not in deviation_kernels:
+                raise ValueError('Unknown deviation type {}!'.format(dev))
+            if deviation_kernels[dev]['span'] is None:
+                raise ValueError('Deviation type {} cannot be accumulated!'.format(dev))
+
+        self.f0 = f0
+        self.f_sampling = f_sampling
+        self.taus = np.asarray(taus, dtype=float)
+        self.devs = tuple(devs)
+        self.size = 0 # phase samples received
+
+        strides, self._inverse = calc_strides(self.taus, f_sampling)
+        self._strides = np.maximum(strides, 1)
+
+        self._sums = np.zeros((len(self.devs), self._strides.size))
+        self._counts = np.zeros((len(self.devs), self._strides.size))
+
+        # phase history needed by the longest difference
+        spans = [deviation_kernels[dev]['span'] for dev in self.devs]
+        self._history = max(spans, default=0) * int(self._strides.max(initial=0))
+        self._tail = np.zeros(0)
+        self._phase_last = 0.
+
+    def add(self, freqs):
+        """Add a block of frequency samples [Hz]"""
+
+        fs_frac = calc_fractional_frequency(np.asarray(freqs, dtype=float), self.f0)
+        phase = calc_phase_error(fs_frac, self.f_sampling)
+        phase += self._phase_last
+        if phase.size == 0:
+            return
+
+        arr = np.concatenate((self._tail, phase))
+        base = self.size - self._tail.size # record index of arr[0]
+        g0 = self.size # record index of first new sample
+        stop = arr.size
+
+        for j, n in enumerate(self._strides):
+            for i, dev in enumerate(self.devs):
+                kernel = deviation_kernels[dev]['sumsq']
+                span = deviation_kernels[dev]['span']
+                decimated = deviation_kernels[dev]['decimated']
+
+                # first difference ending in the new block
+                end = max(g0, span*n)
+                if decimated:
+                    end = -(-end // n) * n
+                start = end - span*n - base
+                if end - base >= stop:
+                    continue
+
+                tmp, count = kernel(arr[start:stop], n)
+                self._sums[i, j] += tmp
+                self._counts[i, j] += count
+
+        self.size += phase.size
+        self._phase_last = phase[-1]
+        self._tail = arr[max(arr.size - self._history, 0):].copy()
+
+    def deviations(self):
+        """Current deviations
+
+        Returns
+        ------
+        Structured array with 'Tau [s]' field and one field per deviation
+        """
+
+        ret = np.zeros(
+            self.taus.size,
+            dtype=[('Tau [s]', float)] + [(dev, float) for dev in self.devs]
+        )
+        ret['Tau [s]'] = self.taus
+        for i, dev in enumerate(self.devs):
+            ret[dev] = calc_deviation_from_sumsq(
+                dev,
+                self._sums[i, self._inverse],
+                self._counts[i, self._inverse],
+                self.taus
+            )
+
+        return ret
+
+# ----- Histogram -----
+class HistogramAccumulator:
+    """Histogram of data received in blocks, in one pass and O(bins) memory
+
+    With fixed limits every block is binned directly, values outside are
+    dropped and the upper limit belongs to the last bin as in np.histogram.
+    Without limits histogram_oversampling times as many fine bins are
+    accumulated. Their range starts at the extent of the first block and
+    doubles whenever a block falls outside, merging pairs of bins, so all
+    counts stay exact for the final edges and at least a quarter of the
+    fine bins cover the data. result merges them back to about bins, which
+    does not depend on how the data was split into blocks. Non-finite
+    values are dropped.
+
+    Parameters
+    ------
+    bins : number of bins
+    limits : (lower, upper) range or None for an adaptive range
+    """
+
+    def __init__(self, bins=100, limits=None):
+
+        if bins < 1:
+            raise ValueError('Number of bins must be positive!')
+        if limits is not None and not limits[1] > limits[0]:
+            raise ValueError('Histogram upper limit must be greater than lower limit!')
+
+        self.adaptive = limits is None
+        self.bins = int(bins) * (histogram_oversampling if self.adaptive else 1)
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.size = 0 # values binned
+        if limits is None:
+            self._lo = None
+            self._width = None
+        else:
+            self._lo = float(limits[0])
+            self._width = (limits[1] - limits[0]) / self.bins
+
+    def _expand(self, left):
+
+        # bins of double width, old edges stay edges
+        merged = self.counts[0::2] + self.counts[1::2]
+        self.counts[:] = 0
+        if left:
+            self._lo -= self.bins*self._width
+            self.counts[self.bins//2:] = merged
+        else:
+            self.counts[:self.bins//2] = merged
+        self._width *= 2
+
+    def add(self, arr):
+        """Add a block of values"""
+
+        arr = np.asarray(arr, dtype=float)
+        arr = arr[np.isfinite(arr)]
+        if arr.size == 0:
+            return
+
+        x1 = arr.min()
+        x2 = arr.max()
+        if self.adaptive:
+            if self._lo is None:
+                # upper value half a bin below the upper edge
+                self._lo = x1
+                self._width = (x2 - x1)/(self.bins - .5) or max(abs(x1), 1.)*np.finfo(float).eps*self.bins
+            while x1 < self._lo:
+                self._expand(left=True)
+            while x2 >= self._lo + self.bins*self._width:
+                self._expand(left=False)
+        else:
+            arr = arr[(arr >= self._lo) & (arr <= self._lo + self.bins*self._width)]
+
+        idx = ((arr - self._lo) / self._width).astype(np.intp)
+        np.clip(idx, 0, self.bins - 1, out=idx) # rounding at the edges
+        self.counts += np.bincount(idx, minlength=self.bins)
+        self.size += arr.size
+
+    def edges(self):
+
+        if self._lo is None:
+            return np.zeros(1) # no bins yet
+
+        return self._lo + self._width*np.arange(self.bins + 1)
+
+    def result(self):
+        """Counts and bin edges, an adaptive range trimmed to non-empty bins
+
+        Adaptive fine bins are merged in groups of the nearest integer
+        ratio to the requested bins, the last group padded with empty bins.
+
+        Returns
+        ------
+        counts : array of bins
+        edges : array of bins + 1
+        """
+
+        edges = self.edges()
+        if not self.adaptive:
+            return self.counts.copy(), edges
+        if self.size == 0:
+            return self.counts[:0].copy(), edges[:1]
+
+        used = np.flatnonzero(self.counts)
+        i0 = used[0]
+        i1 = used[-1] + 1
+        group = max(int(round((i1 - i0) * histogram_oversampling / self.bins)), 1)
+
+        merged = -(-(i1 - i0) // group)
+        counts = np.zeros(merged * group, dtype=self.counts.dtype)
+        counts[:i1-i0] = self.counts[i0:i1]
+        edges = self._lo + self._width*(i0 + group*np.arange(merged + 1))
+
+        return counts.reshape(merged, group).sum(axis=1), edges
+
+def calc_histogram(arr, bins=100, limits=None, chunk_size=histogram_chunk):
+    """Histogram of a possibly memory-mapped array in chunks of chunk_size
+
+    Returns
+    ------
+    counts, edges, see HistogramAccumulator.result
+    """
+
+    acc = HistogramAccumulator(bins, limits)
+    for i in range(0, arr.size, chunk_size):
+        acc.add(arr[i:i+chunk_size])
+
+    return acc.result()
+
+# ----- Dynamic deviations -----
+def calc_dynamic_ADEV(phase_error, taus, f_sampling, window, step=None, callback=None):
+    """Overlapping ADEV in a window sliding along the record
+
+    Squared second differences of every stride are computed once. Moving
+    the window adds the terms entering it and removes the ones leaving it
+    as differences of their running sum, so a stride costs O(N) for all
+    windows instead of O(N) per window.
+
+    Parameters
+    ------
+    window : window length [s]
+    step : window shift [s], window/10 if None
+    callback : callable(done, total) in samples processed
+
+    Returns
+    ------
+    times : window centres [s]
+    ret : array (times, taus) of ADEV, nan where 2 tau does not fit the window
+    """
+
+    x = np.asarray(phase_error)
+    N = x.size
+    if step is None:
+        step = window / 10
+
+    W = int(np.floor(window * f_sampling + stride_tol)) # samples per window
+    H = max(int(np.floor(step * f_sampling + stride_tol)), 1)
+    if W < 3 or W > N:
+        raise ValueError('Window must span between 3 and {} samples!'.format(N))
+
+    starts = np.arange(0, N - W + 1, H)
+    times = (starts + W/2) / f_sampling
+
+    strides, inverse = calc_strides(taus, f_sampling)
+    sums = np.full((starts.size, strides.size), np.nan)
+    cs = np.zeros(N + 1)
+    for k, n in enumerate(strides):
+        n = max(int(n), 1)
+        count = W - 2*n # terms per window
+        if count > 0:
+            tmp = calc_second_diff(x, n)
+            tmp *= tmp
+            np.cumsum(tmp, out=cs[1:tmp.size+1])
+            sums[:, k] = cs[starts + count] - cs[starts]
+            sums[:, k] /= count
+        if callback is not None:
+            callback((k + 1) * N, strides.size * N)
+
+    ret = sums[:, inverse]
+    ret /= 2*np.power(np.asarray(taus, dtype=float), 2)
+    ret = np.sqrt(ret)
+
+    return times, ret
+
+# ----- Theo1 and TheoH -----
+def calc_autocorrelation(x, max_lag):
+    """sum_j x[j] x[j+lag] for lag = 0..max_lag by FFT, zero past the end"""
+
+    N = x.size
+    nfft = 1 << int(np.ceil(np.log2(max(2*N, 2))))
+    tmp = np.fft.rfft(x, nfft)
+    tmp = np.fft.irfft(tmp * np.conj(tmp), nfft)
+
+    ret = np.zeros(max_lag + 1)
+    ret[:min(max_lag + 1, N)] = tmp[:min(max_lag + 1, N)]
+
+    return ret
+
+def calc_half_convolution(u, v, size=None):
+    """sum_{a <= s-a} u[a] v[s-a] for s < size, u and v of length n
+
+    Pairs a < c are split by the highest bit where a and c differ, so
+    every level is one batch of FFT convolutions between sibling blocks,
+    O(n log^2 n) in total. size is at most and defaults to 2n-1.
+    """
+
+    n = u.size
+    size = max(2*n - 1, 0) if size is None else min(size, max(2*n - 1, 0))
+    P = 1 << max(int(np.ceil(np.log2(max(n, 1)))), 0)
+    uu = np.zeros(P)
+    vv = np.zeros(P)
+    uu[:n] = u
+    vv[:n] = v
+
+    ret = np.zeros(2*P)
+    ret[0:2*P:2] += uu * vv # a == c
+
+    B = 1
+    while B < P:
+        # a in the left, c in the right half of blocks of 2B starting below size
+        blocks = min(-(-max(size - B, 0) // (4*B)), P // (2*B))
+        left = uu.reshape(-1, 2, B)[:blocks, 0]
+        right = vv.reshape(-1, 2, B)[:blocks, 1]
+        tmp = np.fft.irfft(np.fft.rfft(left, 2*B) * np.fft.rfft(right, 2*B), 2*B)
+        # pairs of block j land at s = 4jB + B + k, k < 2B - 1
+        out = np.zeros((left.shape[0], 4*B))
+        out[:, B:3*B-1] = tmp[:, :2*B-1]
+        ret[:out.size] += out.reshape(-1)
+        B *= 2
+
+    return ret[:size]
+
+def calc_Theo1_direct_sumsq(phase_error, m):
+    """Weighted Theo1 sum of squares straight from the definition, O(N m)
+
+    sum_{i<N-m} sum_{d<m/2} [x[i] - x[i+m/2-d] + x[i+m] - x[i+m/2+d]]^2 / (m/2-d)
+    """
+
+    x = np.asarray(phase_error)
+    N = x.size
+    if m % 2 or m < 2 or m > N - 1:
+        return 0., 0
+
+    k = m // 2
+    M = N - m
+
+    ret = 0.
+    tmp = np.add(x[:M], x[m:], dtype=np.float64)
+    for d in range(k):
+        diff = tmp - x[k-d:k-d+M] - x[k+d:k+d+M]
+        ret += np.dot(diff, diff) / (k - d)
+
+    return ret, M
+
+def _calc_Theo1_block_sumsq(x, m):
+    # calc_Theo1_sumsq over all positions of x by the expansion below,
+    # direct sum when its expected rounding error exceeds theo1_rtol
+
+    N = x.size
+
+    # terms are blind to a line in the phase, removing it reduces cancellation
+    x = x - x[0] - (x[-1] - x[0]) * np.arange(N) / (N - 1)
+
+    k = m // 2
+    M = N - m
+    L = np.arange(1, k + 1)
+
+    cs = np.zeros(N + 1)
+    np.cumsum(x * x, out=cs[1:])
+    A = calc_autocorrelation(x, m)
+    head = x[:m]
+    tail = x[N-m:]
+    A_head = calc_autocorrelation(head, m)
+    A_tail = calc_autocorrelation(tail, m)
+
+    # lag m - 2L pairs (i+L, i+m-L) lose products at both ends,
+    # head[j] head[m-2L+j] and tail[L+j] tail[m-L+j] for j < L
+    edge = calc_half_convolution(head, head[::-1], m)[2*L-1]
+    edge += calc_half_convolution(tail[::-1], tail, m)[2*L-1]
+
+    squares = cs[M] + (cs[L+M] - cs[L]) + (cs[N-L] - cs[m-L]) + (cs[N] - cs[m])
+    products = A[m] + (A[m-2*L] - edge)
+    products -= A[L] - A_tail[L] + A[L] - A_head[L]
+    products -= A[m-L] - A_tail[m-L] + A[m-L] - A_head[m-L]
+
+    ret = np.sum((squares + 2*products) / L)
+    scale = np.sum(squares / L)
+    if not ret > 0 or np.finfo(float).eps * scale > theo1_rtol * ret:
+        return calc_Theo1_direct_sumsq(x, m)[0]
+
+    return ret
+
+def calc_Theo1_sumsq(phase_error, m):
+    """Weighted Theo1 sum of squares in O(N log N + N/K m log^2 m)
+
+    With L = m/2 - d each term is x[i] - x[i+L] - x[i+m-L] + x[i+m].
+    Squaring gives four window sums of x^2 (prefix sums) and six lagged
+    products over [0, N-m), which are the full autocorrelation minus
+    products near the ends. Those only involve the first and last m
+    samples, so the sums over all L cost two short autocorrelations and
+    two half convolutions in O(m log^2 m).
+
+    The expansion cancels when the phase wanders far beyond the size of
+    the terms (random walk FM), so it runs on blocks of
+    K = max(4 m, theo1_block) positions, each with its own line removed,
+    which bounds the cancellation by about ((K + m) / m)^3. Blocks whose
+    expected rounding error still exceeds theo1_rtol (short windows) use
+    calc_Theo1_direct_sumsq, which costs O(K m) there.
+
+    Parameters
+    ------
+    phase_error : phase samples
+    m : int, even window in samples, tau = 0.75 m / f_sampling
+
+    Returns
+    ------
+    sum of squares, number of window positions N - m
+    """
+
+    x = np.asarray(phase_error, dtype=float)
+    N = x.size
+    if m % 2 or m < 2 or m > N - 1:
+        return 0., 0
+
+    M = N - m
+    K = max(4*m, theo1_block)
+
+    ret = 0.
+    for start in range(0, M, K):
+        ret += _calc_Theo1_block_sumsq(x[start:min(start + K, M) + m], m)
+
+    return ret, M
+
+def calc_Theo1_window(tau, f_sampling):
+    """Even Theo1 window m for tau = 0.75 m / f_sampling"""
+
+    return 2 * int(np.floor(tau * f_sampling / 1.5 + stride_tol))
+
+def calc_Theo1_single(phase_error, tau, f_sampling, max_window=None):
+    """Theo1 deviation
+
+    Parameters
+    ------
+    max_window : decimate the phase so the window stays below max_window
+        samples (fast approximate Theo1 for long records), None for exact
+    """
+
+    m = calc_Theo1_window(tau, f_sampling)
+    if max_window is not None and m > max_window:
+        r = int(np.ceil(m / max_window))
+        phase_error = phase_error[::r]
+        f_sampling = f_sampling / r
+        m = calc_Theo1_window(tau, f_sampling)
+
+    ret, count = calc_Theo1_sumsq(phase_error, m)
+
+    ret /= (0.75*count*np.power(m/f_sampling, 2))
+    ret = np.sqrt(ret)
+
+    return ret
+
+def calc_Theo1(phase_error, taus, f_sampling, max_window=None):
+
+    ret = []
+    print('Calculating Theo1 deviation...')
+    for tau in taus:
+        ret.append(calc_Theo1_single(phase_error, tau, f_sampling, max_window))
+
+    return np.array(ret)
+
+def calc_TheoH(phase_error, taus, f_sampling, max_window=theoh_max_window):
+    """Hybrid of overlapping ADEV and bias-corrected Theo1
+
+    Taus below theoh_switch of the record length use overlapping ADEV,
+    longer ones Theo1 scaled by AVAR / Theo1 variance at the largest
+    tau below the switch (window a multiple of 4, so both share tau).
+    Theo1 windows above max_window use decimated phase, None for exact.
+    """
+
+    phase_error = np.asarray(phase_error)
+    m_b = 4 * int(np.floor(theoh_switch * phase_error.size / 3))
+    tau_b = 0.75 * m_b / f_sampling
+
+    ret = []
+    print('Calculating TheoH deviation...')
+    if m_b >= 4:
+        bias = calc_ADEV_overlapped_single(phase_error, tau_b, f_sampling)
+        bias /= calc_Theo1_single(phase_error, tau_b, f_sampling, max_window)
+    for tau in taus:
+        if m_b < 4 or tau <= tau_b:
+            ret.append(calc_ADEV_overlapped_single(phase_error, tau, f_sampling))
+        else:
+            ret.append(bias * calc_Theo1_single(phase_error, tau, f_sampling, max_window))
+
+    return np.array(ret)
+
 # ----- Confidence intervals and noise type -----
 def calc_r1(fs_frac):
 
-    f_avg = np.average(fs_frac)
-    N = fs_frac.size
-    nom = 0
-    denom = 0
+    z = np.asarray(fs_frac)
+    if z.size < 2:
+        return np.nan
+    z = z - np.average(z)
 
-    # Numerator
-    for i in range(N-1):
-        nom += (fs_frac[i] - f_avg) * (fs_frac[i+1] - f_avg)
-    # Denominator
-    for i in range(N):
-        denom += np.power(fs_frac[i] - f_avg, 2)
+    nom = np.dot(z[:-1], z[1:])
+    denom = np.dot(z, z)
+    if not denom > 0: # constant data, no correlation to estimate
+        return np.nan
 
     ret = nom/denom
 
@@ -154,10 +1544,12 @@ def calc_noise_type(arr_avg):
     flag = True
     d = 0
     ret = 0
-    z = arr_avg
+    z = np.asarray(arr_avg)
 
     while(flag):
         r1 = calc_r1(z)
+        if not np.isfinite(r1): # differenced down to constant or empty data
+            return np.nan
         delta = r1/(r1+1)
 
         if (delta < .25):
@@ -177,73 +1569,319 @@ def calc_noise_id_single(freqs, tau, f_sampling):
 
     return ret
 
-def calc_noise_id(freqs, taus, f_sampling):
+def calc_noise_id(freqs, taus, f_sampling, callback=None, cache=None, key=()):
+    """Noise type for all taus, evaluated once per unique averaging factor
+
+    callback : callable(done, total) called after every averaging factor,
+        may raise to abort the calculation
+    cache : DeviationCache, noise types are stored under key + ('Noise ID', stride)
+    """
+
+    if not isinstance(freqs, CumulativePhase):
+        freqs = np.asarray(freqs)
+    strides, inverse = calc_strides(taus, f_sampling)
 
     ret = []
+    for j, n in enumerate(strides):
+        tmp = None if cache is None else cache.get(key + ('Noise ID', int(n)))
+        if tmp is None:
+            tmp = calc_noise_type(calc_block_avg(freqs, n + 1))
+            if cache is not None:
+                cache.put(key + ('Noise ID', int(n)), tmp)
+        ret.append(tmp)
 
-    for tau in taus:
-        ret.append(calc_noise_id_single(freqs, tau, f_sampling))
+        if callback is not None:
+            callback(j+1, strides.size)
 
-    return np.array(ret)
+    return np.array(ret)[inverse]
+
+# noise type names by S_y(f) ~ f^alpha exponent, index alpha + 2
+noise_types = ('random walk FM', 'flicker FM', 'white FM', 'flicker PM', 'white PM')
+
+def calc_noise_alpha(noiseIDs):
+    """Nearest integer noise exponent in [-2, 2], nan kept"""
+
+    ret = np.floor(np.asarray(noiseIDs, dtype=float) + .5)
+
+    return np.clip(ret, -2, 2)
 
-def calc_confidence_interval_single(dev, tau, f_sampling, noiseID, N):
-
-    avgCount = tau * f_sampling
-    loopCount = N/avgCount # number of loop iterations
-    loopCount_reduced = np.sqrt(loopCount)
-
-    # dominant white PM noise
-    if noiseID >= 1.5:
-        tmp = .99 * dev/loopCount_reduced
-    # dominant flicker PM noise
-    elif noiseID < 1.5 and noiseID >= .5:
-        tmp = .99 * dev/loopCount_reduced
-    # dominant white FM noise
-    elif noiseID < .5 and noiseID >= -.5:
-        tmp = .87 * dev/loopCount_reduced
-    # dominant flicker FM noise
-    elif noiseID < -.5 and noiseID >= -1.5:
-        tmp = .77 * dev/loopCount_reduced
-    # dominant random walk FM noise
+def dominant_noise(noiseIDs):
+
+    alphas = calc_noise_alpha(noiseIDs)
+    alphas[np.isnan(alphas)] = -2
+
+    return np.array(noise_types)[alphas.astype(int) + 2].tolist()
+
+# Equivalent degrees of freedom, Greenhall & Riley, "Uncertainty of
+# stability variances based on finite differences" (2003)
+edf_max_terms = 100 # J_max, longer sums use tables or are resampled
+edf_max_filter = 1e5 # cap of the flicker PM filter factor, limits rounding
+# deviation: d-th differences, modified (phase averaged), overlapping
+edf_params = {
+    'ADEV': {'d': 2, 'modified': False, 'overlapping': False},
+    'ADEV ovlp': {'d': 2, 'modified': False, 'overlapping': True},
+    'HDEV': {'d': 3, 'modified': False, 'overlapping': True},
+    'HDEV non-ovlp': {'d': 3, 'modified': False, 'overlapping': False},
+    'MDEV': {'d': 2, 'modified': True, 'overlapping': True},
+    'TDEV': {'d': 2, 'modified': True, 'overlapping': True},
+    'TOTDEV': {'d': 2, 'modified': False, 'overlapping': True}
+}
+# TOTDEV edf = b T / tau - c for FM noises (NIST SP 1065), alpha: (b, c)
+totdev_edf = {0: (1.50, 0.), -1: (1.168, .222), -2: (.927, .358)}
+
+def calc_edf_sw(t, alpha):
+
+    t = np.abs(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if alpha == 2:
+            return -t
+        if alpha == 0:
+            return t**3
+        if alpha == -2:
+            return t**5
+        ret = t**(3 - alpha) * np.log(t) # alpha = 1 or -1
+    ret[t == 0] = 0
+
+    return ret
+
+def calc_edf_sx(t, F, alpha):
+    """Filter of sw, F = inf stands for the F -> inf limit"""
+
+    F = np.broadcast_to(F, t.shape)
+    ret = np.empty(t.shape)
+
+    limit = np.isinf(F)
+    if limit.any():
+        ret[limit] = calc_edf_sw(t[limit], alpha + 2)
+    if not limit.all():
+        tmp = t[~limit]
+        h = 1 / F[~limit]
+        ret[~limit] = (2*calc_edf_sw(tmp, alpha) - calc_edf_sw(tmp - h, alpha)
+                       - calc_edf_sw(tmp + h, alpha)) / h**2
+
+    return ret
+
+def calc_edf_sz(t, F, alpha, d):
+    """d-th difference filter of sx, coefficients (-1)^k binom(2d, d+k)"""
+
+    ret = np.zeros(np.shape(t))
+    c = 1.
+    for k in range(d + 1):
+        if k == 0:
+            ret += c * calc_edf_sx(t, F, alpha)
+        else:
+            ret += c * (calc_edf_sx(t - k, F, alpha) + calc_edf_sx(t + k, F, alpha))
+        c *= -(d - k) / (d + k + 1)
+    c = 1.
+    for k in range(d):
+        c *= (d + k + 1) / (k + 1)
+
+    return ret * c
+
+def calc_edf_basic_sum(J, M, S, F, alpha, d):
+    """Greenhall BasicSum / (sz(0)^2 M) for arrays of J <= edf_max_terms"""
+
+    j = np.arange(edf_max_terms + 1)
+    J, M, S, F = (np.asarray(tmp, dtype=float)[:, None] for tmp in (J, M, S, F))
+
+    z = calc_edf_sz(j / S, F, alpha, d)**2
+    w = np.where(j < J, 2 * (1 - j / M), 0.)
+    w += np.where(j == J, 1 - J / M, 0.)
+    w[:, 0] = 1
+
+    return np.sum(w * z, axis=1) / (z[:, 0] * M[:, 0])
+
+def calc_edf_table(S=2000):
+    """(a0, a1) of 1/edf ~ (a0 - a1/r)/r for r > d+1, by (modified, alpha, d)
+
+    Sums of sz^2 over |t| <= d+1 sampled at 1/S, i.e. the limit of the
+    basic sum for long records.
+    """
+
+    ret = {}
+    t = np.arange((3 + 1)*S + 1) / S
+    for d in (2, 3):
+        for alpha in range(-2, 3):
+            for modified in (False, True):
+                if not modified and alpha > 0:
+                    continue # white PM closed form, flicker PM depends on m
+                F = 1. if modified else np.inf
+                z = calc_edf_sz(t[:(d+1)*S+1], F, alpha, d)**2
+                a0 = (z[0] + 2*np.sum(z[1:])) / (S * z[0])
+                a1 = 2*np.sum(t[1:(d+1)*S+1] * z[1:]) / (S * z[0])
+                ret[(modified, alpha, d)] = (a0, a1)
+
+    return ret
+
+edf_table = calc_edf_table()
+
+def calc_edf_greenhall(n, alphas, N, d, modified=False, overlapping=True):
+    """Greenhall EDF of a d-th difference variance for all taus at once
+
+    Parameters
+    ------
+    n : array of strides in samples
+    alphas : array of integer noise exponents, nan gives nan
+    N : number of phase samples
+    """
+
+    n = np.maximum(np.asarray(n, dtype=float), 1)
+    alphas = np.asarray(alphas, dtype=float)
+
+    F = np.ones(n.shape) if modified else n.copy()
+    S = n.copy() if overlapping else np.ones(n.shape)
+    L = n / F + n * d
+    M = 1 + np.floor(S * (N - L) / n)
+    J = np.minimum(M, (d + 1) * S)
+    r = M / S
+
+    ret = np.full(n.shape, np.nan)
+    for alpha in range(-2, 3):
+        sel = (alphas == alpha) & (M >= 1)
+        if not sel.any():
+            continue
+
+        if alpha == 2 and not modified:
+            # only terms sharing phase samples correlate
+            K = np.ceil(r[sel])
+            tmp = np.ones(K.shape)
+            rho = 1.
+            for k in range(1, d + 1):
+                rho *= -(d - k + 1) / (d + k)
+                tmp += np.where(k < K, 2 * (1 - k / r[sel]) * rho**2, 0.)
+            ret[sel] = M[sel] / tmp
+            continue
+
+        # sampled FM noise phase is exact at any stride, the F -> inf limit
+        if modified:
+            F_a = F[sel]
+        elif alpha == 1:
+            F_a = np.minimum(F[sel], edf_max_filter)
+        else:
+            F_a = np.full(n[sel].shape, np.inf)
+
+        J_a, M_a, S_a, r_a = J[sel], M[sel], S[sel], r[sel]
+        inv = np.empty(J_a.shape)
+
+        short = J_a <= edf_max_terms
+        table = ~short & (r_a > d + 1) & ((modified, alpha, d) in edf_table)
+        resample = ~short & ~table
+        if short.any():
+            inv[short] = calc_edf_basic_sum(
+                J_a[short], M_a[short], S_a[short], F_a[short], alpha, d)
+        if table.any():
+            a0, a1 = edf_table[(modified, alpha, d)]
+            inv[table] = (a0 - a1 / r_a[table]) / r_a[table]
+        if resample.any():
+            # same r with edf_max_terms samples of sz
+            S_r = edf_max_terms / np.minimum(r_a[resample], d + 1)
+            inv[resample] = calc_edf_basic_sum(
+                np.full(S_r.shape, edf_max_terms), r_a[resample] * S_r, S_r, F_a[resample], alpha, d)
+
+        ret[sel] = 1 / inv
+
+    return ret
+
+def calc_edf(dev, taus, f_sampling, noiseIDs, N):
+    """Equivalent degrees of freedom of a deviation type for all taus"""
+
+    if dev not in edf_params:
+        raise ValueError('Unknown deviation type {}!'.format(dev))
+
+    taus = np.asarray(taus, dtype=float)
+    n, inverse = calc_strides(taus, f_sampling)
+    n = n[inverse]
+    alphas = calc_noise_alpha(noiseIDs)
+
+    if edf_params[dev]['overlapping'] or edf_params[dev]['modified']:
+        ret = calc_edf_greenhall(n, alphas, N, **edf_params[dev])
     else:
-        tmp = .75 * dev/loopCount_reduced
+        # non-overlapping terms are overlapping ones of the decimated phase
+        ret = calc_edf_greenhall(np.ones(n.shape), alphas, (N - 1) // np.maximum(n, 1) + 1, **edf_params[dev])
+
+    if dev == 'TOTDEV':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for alpha, (b, c) in totdev_edf.items():
+                sel = alphas == alpha
+                ret[sel] = b * N / (f_sampling * taus[sel]) - c
+
+    return ret
+
+# Chi-squared quantiles, tabulated on an edf grid at import
+conf_sigma = 1. # interval width in standard normal sigmas, 68.3 %
+chi2_edf_grid = np.geomspace(.05, 100., 200) # Wilson-Hilferty above
+
+def calc_chi2_cdf(x, edf, terms=300):
+    """Regularised lower incomplete gamma P(edf/2, x/2) by its series"""
+
+    a = edf / 2
+    x = x / 2
+    k = np.arange(1, terms)
+    tmp = np.cumprod(x[:, None] / (a[:, None] + k), axis=1)
+    lgamma = np.array([math.lgamma(v + 1) for v in a])
+
+    return np.exp(a * np.log(x) - x - lgamma) * (1 + np.sum(tmp, axis=1))
 
-    return tmp
+def calc_chi2_ppf_wh(p_sigma, edf):
+    """Wilson-Hilferty chi-squared quantile at p_sigma standard normal sigmas"""
 
-def calc_confidence_interval(devs, taus, f_sampling, noiseIDs, N):
+    tmp = 2 / (9 * edf)
+
+    return edf * (1 - tmp + p_sigma * np.sqrt(tmp))**3
+
+def calc_chi2_table():
+    """Quantiles / edf at -conf_sigma and +conf_sigma on chi2_edf_grid"""
 
     ret = []
-    for i in range(devs.size):
-        ret.append(calc_confidence_interval_single(devs[i], taus[i], f_sampling, noiseIDs[i], N))
+    for sigma in (-conf_sigma, conf_sigma):
+        p = .5 * (1 + math.erf(sigma / math.sqrt(2)))
+        lo = np.zeros(chi2_edf_grid.size)
+        hi = chi2_edf_grid + 10 * np.sqrt(2 * chi2_edf_grid) + 10
+        for _ in range(45): # bisection
+            mid = (lo + hi) / 2
+            below = calc_chi2_cdf(mid, chi2_edf_grid) < p
+            lo = np.where(below, mid, lo)
+            hi = np.where(below, hi, mid)
+        ret.append((lo + hi) / 2 / chi2_edf_grid)
 
     return np.array(ret)
 
-def dominant_noise_single(noiseID):
-
-    # dominant white PM noise
-    if noiseID >= 1.5:
-        ret = 'white PM'
-    # dominant flicker PM noise
-    elif noiseID < 1.5 and noiseID >= .5:
-        ret = 'flicker PM'
-    # dominant white FM noise
-    elif noiseID < .5 and noiseID >= -.5:
-        ret = 'white FM'
-    # dominant flicker FM noise
-    elif noiseID < -.5 and noiseID >= -1.5:
-        ret = 'flicker FM'
-    # dominant random walk FM noise
-    else:
-        ret = 'random walk FM'
+chi2_table = calc_chi2_table()
+
+def calc_chi2_ratio(edf):
+    """Quantiles / edf at -conf_sigma and +conf_sigma, shape (2, edf.size)"""
+
+    edf = np.asarray(edf, dtype=float)
+    ret = np.empty((2, edf.size))
+    with np.errstate(invalid='ignore'):
+        for i, sigma in enumerate((-conf_sigma, conf_sigma)):
+            tmp = np.interp(np.log(edf), np.log(chi2_edf_grid), chi2_table[i])
+            ret[i] = np.where(edf > chi2_edf_grid[-1], calc_chi2_ppf_wh(sigma, edf) / edf, tmp)
+    # below the grid the lower quantile tends to zero
+    ret[:, edf < chi2_edf_grid[0]] = np.nan
 
     return ret
 
-def dominant_noise(noiseIDs):
+def calc_confidence_interval(devs, taus, f_sampling, noiseIDs, N, dev='ADEV ovlp'):
+    """Chi-squared confidence interval of deviations from their edf
 
-    ret = []
+    Parameters
+    ------
+    devs : deviations
+    noiseIDs : noise exponents from calc_noise_id
+    N : number of phase samples
+    dev : deviation type, key of edf_params
+
+    Returns
+    ------
+    array (2, taus) of lower and upper deviation bounds
+    """
+
+    edf = calc_edf(dev, taus, f_sampling, noiseIDs, N)
+    ratio = calc_chi2_ratio(edf)
 
-    for noiseID in noiseIDs:
-        ret.append(dominant_noise_single(noiseID))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret = np.asarray(devs) / np.sqrt(ratio[::-1])
 
     return ret
 
@@ -271,15 +1909,15 @@ if __name__ == '__main__':
     )
 
     # Deviations
-    adevs = calc_ADEV(phase_error, taus)
+    adevs = calc_ADEV(phase_error, taus, f_sampling)
     adevs_overlapped = calc_ADEV_overlapped(phase_error, taus, f_sampling)
     hdevs = calc_HDEV(phase_error, taus, f_sampling)
 
     # Noise type and confidence interval
     alphas = calc_noise_id(freqs, taus, f_sampling)
-    conf_int_adev = calc_confidence_interval(adevs, taus, f_sampling, alphas, N)
-    conf_int_adev_overlapped = calc_confidence_interval(adevs_overlapped, taus, f_sampling, alphas, N)
-    conf_int_hdev = calc_confidence_interval(hdevs, taus, f_sampling, alphas, N)
+    conf_int_adev = calc_confidence_interval(adevs, taus, f_sampling, alphas, N, 'ADEV')
+    conf_int_adev_overlapped = calc_confidence_interval(adevs_overlapped, taus, f_sampling, alphas, N, 'ADEV ovlp')
+    conf_int_hdev = calc_confidence_interval(hdevs, taus, f_sampling, alphas, N, 'HDEV')
 
     noise_dom = dominant_noise(alphas)
     print('Dominant noise: ', noise_dom)
@@ -321,7 +1959,7 @@ if __name__ == '__main__':
     ax.errorbar(
         taus,
         adevs,
-        yerr=conf_int_adev,
+        yerr=np.abs(conf_int_adev - adevs),
         markersize=3,
         fmt='o',
         label='ADEV'
@@ -329,7 +1967,7 @@ if __name__ == '__main__':
     ax.errorbar(
         taus,
         adevs_overlapped,
-        yerr=conf_int_adev_overlapped,
+        yerr=np.abs(conf_int_adev_overlapped - adevs_overlapped),
         markersize=3,
         fmt='^',
         label='ADEV overlapped'
@@ -337,7 +1975,7 @@ if __name__ == '__main__':
     ax.errorbar(
         taus,
         hdevs,
-        yerr=conf_int_hdev,
+        yerr=np.abs(conf_int_hdev - hdevs),
         markersize=3,
         fmt='x',
         label='HDEV'
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+freq_column = 'Frequency [Hz]'
+chunk_rows = 2**20 # rows parsed per chunk
+max_header_lines = 1000
+delimiters = (',', ';', '\t')
+binary_ext = '.f64'
+
+cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'FrequencyStability')
+cache_max_bytes = 10 * 2**30 # LRU eviction above this size
+hash_block = 2**20 # bytes hashed at start, middle and end of a file
+cache_stats = {'hits': 0, 'misses': 0, 'saved [s]': 0.}
+
+
+# ----- Header -----
+def parse_meta_line(line, delimiter):
+
+    line = line.strip().lstrip('#').strip()
+    for sep in (delimiter, ':'):
+        if sep in line:
+            key, value = line.split(sep, 1)
+            break
+    else:
+        return None, None
+
+    key = key.strip()
+    value = value.strip().strip(delimiter).strip()
+    try:
+        value = float(value)
+    except ValueError:
+        pass
+
+    return key, value
+
+def read_header(path):
+    """Parse metadata lines preceding the data columns
+
+    Metadata lines are 'key<delimiter>value' or 'key: value', optionally
+    commented with '#'. The column line is the first one naming the
+    frequency column.
+
+    Returns
+    ------
+    meta : dict
+    columns : list of column names
+    skiprows : number of lines before the first data row
+    delimiter : column delimiter
+    """
+
+    meta = {}
+    with open(path, 'r') as f:
+        for i, line in enumerate(f):
+            if i >= max_header_lines:
+                break
+            if freq_column in line:
+                delimiter = max(delimiters, key=line.count)
+                columns = [c.strip() for c in line.strip().split(delimiter)]
+                return meta, columns, i + 1, delimiter
+            if not line.strip():
+                continue
+            key, value = parse_meta_line(line, ',')
+            if key:
+                meta[key] = value
+
+    raise KeyError('Could not find {} column in {}!'.format(freq_column, path))
+
+# ----- Data -----
+def load_frequency(path, out_path=None, chunk_size=chunk_rows):
+    """Stream the frequency column of a file into a memory-mapped array
+
+    The file is parsed in chunks of chunk_size rows and appended to a
+    float64 file, so files larger than memory can be loaded.
+
+    Parameters
+    ------
+    path : input csv/txt file
+    out_path : binary output, temporary file removed on unmapping if None
+    chunk_size : rows per chunk
+
+    Returns
+    ------
+    freqs : read-only np.memmap of frequencies [Hz]
+    meta : dict of metadata
+    """
+
+    meta, columns, skiprows, delimiter = read_header(path)
+
+    temporary = out_path is None
+    if temporary:
+        fd, out_path = tempfile.mkstemp(suffix='.f64')
+        os.close(fd)
+
+    size = 0
+    with open(out_path, 'wb') as out:
+        reader = pd.read_csv(
+            path,
+            sep=delimiter,
+            skiprows=skiprows,
+            header=None,
+            names=columns,
+            usecols=[freq_column],
+            dtype={freq_column: np.float64},
+            chunksize=chunk_size
+        )
+        for chunk in reader:
+            tmp = chunk[freq_column].to_numpy(dtype=np.float64)
+            out.write(tmp.tobytes())
+            size += tmp.size
+
+    if size == 0:
+        freqs = np.zeros(0)
+    else:
+        freqs = np.memmap(out_path, dtype=np.float64, mode='r', shape=(size,))
+
+    # the mapping stays valid after unlinking on POSIX systems
+    if temporary:
+        try:
+            os.unlink(out_path)
+        except OSError:
+            pass
+
+    return freqs, meta
+
+# ----- Binary -----
+def write_binary_info(info_path, size, meta, extra=None):
+    """Write json sidecar of a float64 frequency file"""
+
+    info = {'size': int(size), 'meta': meta}
+    if extra is not None:
+        info.update(extra)
+    with open(info_path, 'w') as f:
+        json.dump(info, f)
+
+def load_binary(path, info_path=None):
+    """Memory-map a float64 frequency file with its json sidecar
+
+    Parameters
+    ------
+    path : raw float64 file
+    info_path : json with 'size' and 'meta', path + '.json' if None
+
+    Returns
+    ------
+    freqs : read-only np.memmap of frequencies [Hz]
+    info : dict from the json sidecar
+    """
+
+    if info_path is None:
+        info_path = path + '.json'
+
+    with open(info_path, 'r') as f:
+        info = json.load(f)
+
+    if info['size'] > 0:
+        freqs = np.memmap(path, dtype=np.float64, mode='r', shape=(info['size'],))
+    else:
+        freqs = np.zeros(0)
+
+    return freqs, info
+
+# ----- Cache -----
+def calc_file_key(path):
+    """Cache key from path, size, mtime and a content hash
+
+    The content hash covers hash_block bytes at the start, middle and end
+    of the file, so keying a multi-gigabyte file costs three reads.
+    """
+
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+
+    h = hashlib.sha256()
+    h.update('{}|{}|{}'.format(path, stat.st_size, stat.st_mtime_ns).encode())
+    with open(path, 'rb') as f:
+        for offset in (0, stat.st_size // 2, max(stat.st_size - hash_block, 0)):
+            f.seek(offset)
+            h.update(f.read(hash_block))
+
+    return h.hexdigest()
+
+def evict_cache(directory=None, max_bytes=cache_max_bytes):
+    """Remove least recently used entries until the cache fits max_bytes"""
+
+    if directory is None:
+        directory = cache_dir
+
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            key = name[:-len('.json')]
+            info_path = os.path.join(directory, name)
+            data_path = os.path.join(directory, key + '.f64')
+            size = os.path.getsize(data_path) if os.path.exists(data_path) else 0
+            entries.append((os.path.getmtime(info_path), size, info_path, data_path))
+
+    total = sum(e[1] for e in entries)
+    for _, size, info_path, data_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        for tmp in (info_path, data_path):
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        total -= size
+
+def load_frequency_cached(path, directory=None, max_bytes=cache_max_bytes, chunk_size=chunk_rows):
+    """load_frequency with a binary cache of the parsed frequency column
+
+    Entries are keyed by calc_file_key and hold a float64 file plus
+    json metadata. Hits are memory-mapped directly, misses are parsed
+    and stored, then the least recently used entries are evicted.
+
+    Returns
+    ------
+    freqs : read-only np.memmap of frequencies [Hz]
+    meta : dict of metadata
+    """
+
+    if directory is None:
+        directory = cache_dir
+    os.makedirs(directory, exist_ok=True)
+
+    key = calc_file_key(path)
+    info_path = os.path.join(directory, key + '.json')
+    data_path = os.path.join(directory, key + '.f64')
+
+    start = time.time()
+    if os.path.exists(info_path) and os.path.exists(data_path):
+        freqs, info = load_binary(data_path, info_path)
+        os.utime(info_path) # mark as recently used
+
+        saved = info['parse time [s]'] - (time.time() - start)
+        cache_stats['hits'] += 1
+        cache_stats['saved [s]'] += saved
+        print('Cache hit for {} ({:.2f} s saved)'.format(path, saved))
+
+        return freqs, info['meta']
+
+    tmp_path = data_path + '.part'
+    freqs, meta = load_frequency(path, out_path=tmp_path, chunk_size=chunk_size)
+    os.replace(tmp_path, data_path)
+    parse_time = time.time() - start
+    write_binary_info(
+        info_path,
+        freqs.size,
+        meta,
+        extra={'source': os.path.abspath(path), 'parse time [s]': parse_time}
+    )
+
+    cache_stats['misses'] += 1
+    print('Cache miss for {} (parsed in {:.2f} s)'.format(path, parse_time))
+
+    evict_cache(directory, max_bytes)
+
+    return freqs, meta
+
+# ----- Dispatch -----
+def load_file(path, cache=True):
+    """Load frequencies [Hz] and metadata of a csv/txt or float64 file
+
+    Returns
+    ------
+    freqs : read-only np.memmap of frequencies [Hz]
+    meta : dict of metadata
+    """
+
+    if path.endswith(binary_ext):
+        freqs, info = load_binary(path)
+        return freqs, info['meta']
+
+    if cache:
+        return load_frequency_cached(path)
+
+    return load_frequency(path)
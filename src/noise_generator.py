@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+
+import numpy as np
+
+from src.loader import write_binary_info
+
+
+# noise type: exponent a of fractional frequency PSD S_y(f) ~ f^a
+noise_exponents = {
+    'white PM': 2,
+    'flicker PM': 1,
+    'white FM': 0,
+    'flicker FM': -1,
+    'random walk FM': -2
+}
+block_size = 2**20 # samples generated per block
+filter_size = 2**16 # taps of flicker noise filters, sets lowest flicker frequency
+
+
+# ----- Power-law components -----
+def calc_filter(a, size):
+    """Impulse response shaping white noise into S_y(f) ~ f^a
+
+    Kasdin & Walter fractional differencing filter,
+    h_0 = 1, h_k = h_(k-1) * (k - 1 - a/2) / k
+    """
+
+    k = np.arange(1, size)
+    ret = np.ones(size)
+    ret[1:] = np.cumprod((k - 1 - a/2) / k)
+
+    return ret
+
+class PowerLawNoise:
+    """One power-law noise component generated block by block
+
+    Integer exponents use exact recursions (differencing or summing white
+    noise), flicker exponents an FFT overlap-save convolution with a
+    truncated calc_filter response. State is carried between blocks, so
+    consecutive blocks form one continuous series in bounded memory.
+
+    Parameters
+    ------
+    a : exponent of S_y(f) ~ f^a, one of noise_exponents values
+    amplitude : std of the driving white noise (fractional frequency)
+    rng : np.random.Generator
+    """
+
+    def __init__(self, a, amplitude, rng, filter_size=filter_size):
+
+        self.a = a
+        self.amplitude = amplitude
+        self._rng = rng
+
+        self._last = 0. # last white phase (a=2) or running sum (a=-2)
+        if a in (-1, 1):
+            self._h = calc_filter(a, filter_size)
+            self._history = np.zeros(filter_size - 1)
+
+    def generate(self, size):
+
+        w = self._rng.standard_normal(size)
+        w *= self.amplitude
+
+        if self.a == 0:
+            return w
+
+        if self.a == 2:
+            ret = np.diff(w, prepend=self._last)
+            self._last = w[-1]
+            return ret
+
+        if self.a == -2:
+            ret = np.cumsum(w)
+            ret += self._last
+            self._last = ret[-1]
+            return ret
+
+        # overlap-save, output depends on the last filter_size-1 samples
+        L = self._h.size
+        x = np.concatenate((self._history, w))
+        nfft = 1 << int(np.ceil(np.log2(x.size + L - 1)))
+        ret = np.fft.irfft(np.fft.rfft(x, nfft) * np.fft.rfft(self._h, nfft), nfft)
+        ret = ret[L-1:L-1+size]
+        self._history = x[x.size-(L-1):]
+
+        return ret
+
+def generate_blocks(N, levels, seed=None, block_size=block_size, filter_size=filter_size):
+    """Fractional frequency with a mixture of power-law noises, in blocks
+
+    Parameters
+    ------
+    N : number of samples
+    levels : dict {noise type: amplitude}, keys of noise_exponents
+    seed : seed of np.random.default_rng
+
+    Yields
+    ------
+    Blocks of at most block_size samples of fractional frequency
+    """
+
+    for name in levels:
+        if name not in noise_exponents:
+            raise ValueError('Unknown noise type {}!'.format(name))
+
+    rng = np.random.default_rng(seed)
+    components = [PowerLawNoise(noise_exponents[name], amplitude, rng, filter_size)
+                  for name, amplitude in levels.items()]
+
+    done = 0
+    while done < N:
+        size = min(block_size, N - done)
+        ret = np.zeros(size)
+        for component in components:
+            ret += component.generate(size)
+        done += size
+
+        yield ret
+
+def generate_fractional_frequency(N, levels, seed=None, **kwargs):
+    """Whole fractional frequency series, see generate_blocks"""
+
+    return np.concatenate(list(generate_blocks(N, levels, seed, **kwargs)) or [np.zeros(0)])
+
+# ----- Output -----
+def write_csv(path, N, f0, f_sampling, levels, seed=None, **kwargs):
+    """Write generated frequencies [Hz] in the format read by src.loader"""
+
+    with open(path, 'w') as f:
+        f.write('Central frequency [Hz],{}\n'.format(f0))
+        f.write('Sampling frequency [Hz],{}\n'.format(f_sampling))
+        f.write('Frequency [Hz]\n')
+        for block in generate_blocks(N, levels, seed, **kwargs):
+            block += 1
+            block *= f0
+            np.savetxt(f, block, fmt='%.17g')
+
+def write_binary(path, N, f0, f_sampling, levels, seed=None, **kwargs):
+    """Write generated frequencies [Hz] as float64 file with json sidecar
+
+    Read back with src.loader.load_binary.
+    """
+
+    with open(path, 'wb') as f:
+        for block in generate_blocks(N, levels, seed, **kwargs):
+            block += 1
+            block *= f0
+            f.write(block.tobytes())
+
+    meta = {
+        'Central frequency [Hz]': f0,
+        'Sampling frequency [Hz]': f_sampling
+    }
+    write_binary_info(path + '.json', N, meta, extra={'levels': levels, 'seed': seed})
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Generate power-law frequency noise')
+    parser.add_argument('output', help='.csv/.txt or .f64 file')
+    parser.add_argument('-N', type=float, default=1e6, help='number of samples')
+    parser.add_argument('--f0', type=float, default=1e6, help='central frequency [Hz]')
+    parser.add_argument('--fs', type=float, default=1., help='sampling frequency [Hz]')
+    parser.add_argument('--seed', type=int)
+    for name in noise_exponents:
+        parser.add_argument('--' + name.replace(' ', '-'), type=float, default=0.,
+                            help='amplitude of {} noise'.format(name))
+    args = parser.parse_args()
+
+    levels = {}
+    for name in noise_exponents:
+        amplitude = getattr(args, name.replace(' ', '_'))
+        if amplitude:
+            levels[name] = amplitude
+    if not levels:
+        levels['white FM'] = 1e-11
+
+    if args.output.endswith('.f64'):
+        write_binary(args.output, int(args.N), args.f0, args.fs, levels, args.seed)
+    else:
+        write_csv(args.output, int(args.N), args.f0, args.fs, levels, args.seed)
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+
+import contextlib
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+import src.frequency_stability as fs
+from widgets.PlotCanvas import EnvelopePyramid
+
+
+chunk_size = 2**20 # samples per kernel call between cancellation checks
+histogram_bins = 100 # bins of the frequency histogram
+progress_interval = 0.1 # s, minimal time between progress signals
+
+
+class AnalysisWorker(QObject):
+    """Runs the analysis pipeline outside of the GUI thread
+
+    Move to a QThread and connect its started signal to run. Progress is
+    reported in samples processed over the whole pipeline, cancel() is
+    checked after every kernel chunk. With params['Memory report'] the
+    peak traced memory of every stage is returned, allocations of
+    parallel worker processes are not included.
+
+    Signals
+    ------
+    progress : (stage, done, total)
+    partial : (dev, taus, deviations) as soon as a stride is done
+    finished : dict with histogram, cum_phase, envelope, devs, conf_int,
+        noise_type, dynamic, memory; histogram is (counts, edges) of the
+        frequencies and envelope the EnvelopePyramid of fractional frequency
+    canceled
+    failed : error message
+    """
+
+    progress = pyqtSignal(str, float, float)
+    partial = pyqtSignal(str, object, object)
+    finished = pyqtSignal(object)
+    canceled = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, freqs, params, taus, devs, cum_phase=None, envelope=None, cache=None, cache_key=()):
+
+        super().__init__()
+
+        self._freqs = freqs
+        self._params = params
+        self._taus = taus
+        self._devs = devs
+        self._cum_phase = cum_phase
+        self._envelope = envelope # reused with cum_phase
+        self._cache = cache # DeviationCache shared between analyses
+        self._cache_key = cache_key
+
+        # plain flag so cancel() works while run() blocks the worker thread
+        self._cancel = threading.Event()
+        self._last_emit = 0
+        self._memory = None # stage: peak traced memory [B]
+
+    def cancel(self):
+
+        self._cancel.set()
+
+    def run(self):
+
+        if self._params.get('Memory report'):
+            self._memory = {}
+            tracemalloc.start()
+        try:
+            ret = self.analyse()
+        except InterruptedError:
+            self.canceled.emit()
+            return
+        except (ValueError, MemoryError) as e:
+            self.failed.emit(str(e))
+            return
+        except Exception as e:
+            # any error has to end the thread, otherwise it never quits
+            self.failed.emit('{}: {}'.format(type(e).__name__, e))
+            return
+        finally:
+            if self._memory is not None:
+                tracemalloc.stop()
+
+        self.finished.emit(ret)
+
+    def _report(self, stage, done, total, force=False):
+
+        if self._cancel.is_set():
+            raise InterruptedError
+
+        now = time.time()
+        if force or now - self._last_emit > progress_interval:
+            self._last_emit = now
+            self.progress.emit(stage, done, total)
+
+    @contextlib.contextmanager
+    def _stage(self, stage):
+
+        if self._memory is None:
+            yield
+            return
+
+        tracemalloc.reset_peak()
+        yield
+        self._memory[stage] = tracemalloc.get_traced_memory()[1]
+
+    def _isCached(self, dev, n):
+
+        if self._cache is None:
+            return False
+
+        return self._cache_key + (dev, int(n)) in self._cache
+
+    def analyse(self):
+
+        f_sampling = self._params['Sampling frequency [Hz]']
+        N = self._params['N']
+
+        # Cost of every stage in samples processed, cached results are free
+        strides, _ = fs.calc_strides(self._taus, f_sampling)
+        cost_hist = N
+        cost_phase = 0 if self._cum_phase is not None else 2*N
+        cost_envelope = 0 if self._cum_phase is not None and self._envelope is not None else N
+        cost_devs = sum(fs.calc_deviation_cost(N, n, dev)
+                        for n in strides for dev in self._devs
+                        if not self._isCached(dev, n))
+        noise_costs = np.cumsum([0 if self._isCached('Noise ID', n) else N/(n + 1)
+                                 for n in strides])
+        cost_noise = noise_costs[-1] if noise_costs.size else 0
+        dynamic = self._params.get('Dynamic window [s]') is not None
+        cost_dynamic = N*strides.size if dynamic else 0
+        total = cost_hist + cost_phase + cost_envelope + cost_devs + cost_noise + cost_dynamic
+
+        # Frequency histogram, one chunked pass over the data
+        self._report('Calculating histogram', 0, total, force=True)
+        with self._stage('histogram'):
+            hist = fs.calc_histogram(self._freqs, histogram_bins)
+        offset = cost_hist
+
+        # Fractional frequency and phase error, accumulated chunk by chunk
+        if self._cum_phase is None:
+            self._envelope = None
+            self._report('Calculating fractional frequency', offset, total, force=True)
+            with self._stage('fractional frequency'):
+                self._cum_phase = fs.CumulativePhase.from_frequency(
+                    self._freqs,
+                    self._params['Central frequency [Hz]'],
+                    f_sampling,
+                    dtype=np.float32 if self._params.get('Float32') else np.float64
+                )
+        if self._memory is not None:
+            # a reused cumulative phase is held but allocated before tracing started
+            self._memory['cumulative phase storage'] = self._cum_phase.nbytes
+        offset += cost_phase
+
+        # Min/max envelope of fractional frequency for plotting
+        if self._envelope is None:
+            self._report('Calculating plot envelope', offset, total, force=True)
+            with self._stage('plot envelope'):
+                self._envelope = EnvelopePyramid(self._cum_phase.fractional_frequency)
+        offset += cost_envelope
+
+        # Deviations
+        self._report('Calculating deviations', offset, total, force=True)
+        with self._stage('deviations'):
+            res = fs.calc_deviations(
+                self._cum_phase.phase_error,
+                self._taus,
+                f_sampling,
+                self._devs,
+                callback=lambda done, _: self._report(
+                    'Calculating deviations', offset + done, total),
+                chunk_size=chunk_size,
+                workers=self._params['Workers'],
+                cache=self._cache,
+                key=self._cache_key,
+                result_callback=lambda dev, idx, values: self.partial.emit(
+                    dev, self._taus[idx], values)
+            )
+        devs = {dev: res[dev] for dev in self._devs}
+        offset += cost_devs
+
+        # Noise types
+        with self._stage('noise types'):
+            alphas = fs.calc_noise_id(
+                self._cum_phase,
+                self._taus,
+                f_sampling,
+                callback=lambda done, _: self._report(
+                    'Calculating noise types', offset + noise_costs[done-1], total),
+                cache=self._cache,
+                key=self._cache_key
+            )
+        noise_type = fs.dominant_noise(alphas)
+        offset += cost_noise
+
+        # Confidence intervals
+        self._report('Calculating confidence intervals', offset, total, force=True)
+        conf_int = {}
+        with self._stage('confidence intervals'):
+            for dev in self._devs:
+                conf_int[dev] = fs.calc_confidence_interval(
+                    devs[dev],
+                    self._taus,
+                    f_sampling,
+                    alphas,
+                    N,
+                    dev
+                )
+
+        # Dynamic Allan deviation, time x tau map
+        dyn = None
+        if dynamic:
+            with self._stage('dynamic Allan deviation'):
+                times, adevs = fs.calc_dynamic_ADEV(
+                    self._cum_phase.phase_error,
+                    self._taus,
+                    f_sampling,
+                    self._params['Dynamic window [s]'],
+                    self._params['Dynamic step [s]'],
+                    callback=lambda done, _: self._report(
+                        'Calculating dynamic Allan deviation', offset + done, total)
+                )
+            dyn = {'times': times, 'adevs': adevs}
+
+        ret = {
+            'histogram': hist,
+            'cum_phase': self._cum_phase,
+            'envelope': self._envelope,
+            'devs': devs,
+            'conf_int': conf_int,
+            'noise_type': noise_type,
+            'dynamic': dyn,
+            'memory': self._memory
+        }
+
+        return ret
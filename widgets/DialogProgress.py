@@ -1,55 +1,40 @@
 # -*- coding: utf-8 -*-
 
 import time
-import numpy as np
 
 from PyQt5.QtWidgets import QProgressDialog
 
-from src.frequency_stability import calc_ADEV_single, calc_ADEV_overlapped_single, calc_HDEV_single
 
+progress_steps = 1000 # resolution of progress bars
 
-dev_msg = {
-    'ADEV': 'Calculating Allan deviation',
-    'ADEV ovlp': 'Calculating Allan overlapping deviation',
-    'HDEV': 'Calculating Hadamard deviation'
-}
 
-def calcDeviationProgress(*args, **kwargs):
+class DialogAnalysisProgress(QProgressDialog):
+    """Progress of an AnalysisWorker, eta from samples processed"""
 
-    ret = []
-    N = kwargs['taus'].size
+    def __init__(self, parent=None):
 
-    progress = QProgressDialog(dev_msg[kwargs['dev']], "Cancel", 0, N, kwargs['parent'])
-    progress.setModal(True)
-    for i, tau in enumerate(kwargs['taus']):
-        start = time.time()
-        progress.setValue(i)
+        super().__init__('Analysing...', "Cancel", 0, progress_steps, parent)
+        self.setModal(True)
 
-        if kwargs['dev'] == 'ADEV':
-            tmp = calc_ADEV_single(kwargs['phase_error'], tau)
-        elif kwargs['dev'] == 'ADEV ovlp':
-            tmp = calc_ADEV_overlapped_single(kwargs['phase_error'], tau, kwargs['f_sampling'])
-        elif kwargs['dev'] == 'HDEV':
-            tmp = calc_HDEV_single(kwargs['phase_error'], tau, kwargs['f_sampling'])
-        else:
-            tmp = 0
+        self._start = time.time()
 
-        ret.append(tmp)
+    def updateProgress(self, stage, done, total):
 
-        if progress.wasCanceled():
-            raise InterruptedError
-        stop = time.time()
-        speed = 1/(stop-start)
-        time_left = (N-i)/speed
-        progress.setLabelText('{0}\neta: {1:.2f} s ({2:.2f}/s)'.format(
-            dev_msg[kwargs['dev']],
+        # everything cached, nothing left to compute
+        if total <= 0:
+            self.setLabelText(stage)
+            return
+
+        self.setValue(min(int(progress_steps*done/total), progress_steps - 1))
+
+        elapsed = time.time() - self._start
+        if done <= 0 or elapsed <= 0:
+            self.setLabelText(stage)
+            return
+        speed = done/elapsed
+        time_left = (total-done)/speed
+        self.setLabelText('{0}\neta: {1:.2f} s ({2:.2e} samples/s)'.format(
+            stage,
             time_left,
             speed
         ))
-
-    progress.setValue(N)
-
-    if len(ret) == N:
-        ret = np.array(ret)
-
-    return ret
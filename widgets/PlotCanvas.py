@@ -1,3 +1,5 @@
+import time
+
 import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_qt5agg import(
@@ -11,6 +13,77 @@ import numpy as np
 from PyQt5.QtWidgets import QSizePolicy, QWidget, QVBoxLayout
 
 
+envelope_base = 8 # samples per block of the finest envelope level
+envelope_chunk = 2**22 # samples reduced at once when building it
+points_per_pixel = 2 # min and max of every pixel column
+blit_interval = 0.1 # s, minimal time between progressive redraws
+
+
+class EnvelopePyramid:
+    """Min/max envelope of y over blocks of base, 2 base, 4 base, ... samples
+
+    Built once per line, so drawing any x-range costs O(visible blocks)
+    at the coarsest level still resolving the screen.
+    """
+
+    def __init__(self, y, base=envelope_base):
+
+        self.y = y
+        self.base = base
+
+        size = -(-y.size // base)
+        lo = np.empty(size)
+        hi = np.empty(size)
+        step = max(envelope_chunk // base, 1) * base
+        for start in range(0, y.size, step):
+            tmp = np.asarray(y[start:start+step])
+            idx = np.arange(0, tmp.size, base)
+            lo[start//base:start//base+idx.size] = np.minimum.reduceat(tmp, idx)
+            hi[start//base:start//base+idx.size] = np.maximum.reduceat(tmp, idx)
+
+        self.levels = {base: (lo, hi)}
+        while lo.size > 1:
+            idx = np.arange(0, lo.size, 2)
+            lo = np.minimum.reduceat(lo, idx)
+            hi = np.maximum.reduceat(hi, idx)
+            base *= 2
+            self.levels[base] = (lo, hi)
+
+    def limits(self):
+
+        lo, hi = self.levels[max(self.levels)]
+
+        return lo[0], hi[0]
+
+    def envelope(self, i0, i1, max_points):
+        """Sample positions and values of y[i0:i1] in at most ~max_points
+
+        Raw samples when they fit, otherwise min and max of every block
+        of the coarsest level with enough blocks.
+        """
+
+        i0 = max(int(i0), 0)
+        i1 = min(int(i1), self.y.size)
+        if i1 <= i0:
+            return np.zeros(0), np.zeros(0)
+        if i1 - i0 <= max_points:
+            return np.arange(i0, i1), np.asarray(self.y[i0:i1])
+
+        b = self.base
+        while 2*(-(-(i1 - i0) // b)) > max_points and 2*b in self.levels:
+            b *= 2
+        lo, hi = self.levels[b]
+        k0 = i0 // b
+        k1 = min(-(-i1 // b), lo.size)
+
+        idx = np.repeat(np.arange(k0, k1) * b + (b - 1)/2, 2)
+        ret = np.empty(2*(k1 - k0))
+        ret[0::2] = lo[k0:k1]
+        ret[1::2] = hi[k0:k1]
+
+        return idx, ret
+
+
 class PlotCanvas(QWidget):
 
     def __init__(self, xLabel="", yLabel="", parent=None, toolbar=False):
@@ -40,6 +113,8 @@ class PlotCanvas(QWidget):
         if self._toolbar:
             self.toolbar = NavigationToolbar(self.canvas, parent)
         self.canvas.setParent(parent)
+        self.canvas.mpl_connect('resize_event', lambda event: self.update_decimated())
+        self.canvas.mpl_connect('draw_event', self._on_draw)
 
         self.init_layout()
 
@@ -47,6 +122,12 @@ class PlotCanvas(QWidget):
 
         self._axes = self._fig.add_subplot(111)
         self._lns = list()
+        self._colorbar = None
+        self._decimated = {} # axis: (envelope, line, x0, dx, callback id)
+        self._progressive = {} # (axis, label): animated line
+        self._background = None # figure without animated lines
+        self._layout_changed = False
+        self._last_blit = 0
 
         self.axes = {
             'main' : self._axes
@@ -85,6 +166,9 @@ class PlotCanvas(QWidget):
 
         self.axes[axis].clear()
         self.lns[axis].clear()
+        self._decimated.pop(axis, None)
+        for key in [k for k in self._progressive if k[0] == axis]:
+            del self._progressive[key]
         self.set_style()
 
         # print(kwargs)
@@ -125,6 +209,162 @@ class PlotCanvas(QWidget):
 
         return True
 
+    def plot_decimated(self, y, dx=1., x0=0., axis='main', envelope=None, **kwargs):
+        """Plot evenly spaced data through a min/max envelope
+
+        Only the visible x-range is redrawn at about points_per_pixel
+        points per pixel column whenever the x-limits change, so pan and
+        zoom cost depends on screen width rather than data length.
+
+        Parameters
+        ------
+        y : data, may be memory-mapped
+        dx : x spacing of samples
+        x0 : x of first sample
+        envelope : EnvelopePyramid of y built beforehand, e.g. in a worker
+            thread, None to build it here
+
+        Keyword arguments
+        ------
+        **kwargs for plt.plot
+        """
+
+        if axis in self._decimated:
+            self.axes[axis].callbacks.disconnect(self._decimated[axis][4])
+
+        if envelope is None:
+            envelope = EnvelopePyramid(y)
+        ln = self.axes[axis].plot([], [], **kwargs)[0]
+        self._lns += [ln]
+
+        cid = self.axes[axis].callbacks.connect(
+            'xlim_changed', lambda ax: self.update_decimated(axis))
+        self._decimated[axis] = (envelope, ln, x0, dx, cid)
+
+        y1, y2 = envelope.limits()
+        margin = .05*(y2 - y1) if y2 > y1 else 1.
+        self.axes[axis].set_ylim(y1 - margin, y2 + margin)
+        self.axes[axis].set_xlim(x0, x0 + dx*max(y.size - 1, 1)) # draws the line
+
+        return True
+
+    def update_decimated(self, axis=None):
+
+        axes = [axis] if axis is not None else list(self._decimated)
+        for axis in axes:
+            if axis not in self._decimated:
+                continue
+            envelope, ln, x0, dx, _ = self._decimated[axis]
+
+            x1, x2 = self.axes[axis].get_xlim()
+            width = max(int(self.axes[axis].bbox.width), 1)
+            idx, ys = envelope.envelope(
+                np.floor((x1 - x0)/dx),
+                np.ceil((x2 - x0)/dx) + 1,
+                points_per_pixel*width
+            )
+            ln.set_data(x0 + idx*dx, ys)
+
+        self.canvas.draw_idle()
+
+    def plot_progressive(self, x, y, label, axis='main', **kwargs):
+        """Add points to an animated line while results arrive
+
+        Points are kept sorted by x. Only the animated lines are blitted
+        over the cached background, at most every blit_interval seconds.
+        The figure is rescaled and redrawn in full only when new points
+        leave the current view.
+
+        Parameters
+        ------
+        x : x axis data
+        y : y axis data, non-finite (and non-positive on log axes) dropped
+        label : str, one line per label
+
+        Keyword arguments
+        ------
+        **kwargs for plt.plot of a new line
+        """
+
+        ax = self.axes[axis]
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        valid = np.isfinite(x) & np.isfinite(y)
+        if ax.get_xscale() == 'log':
+            valid &= x > 0
+        if ax.get_yscale() == 'log':
+            valid &= y > 0
+        x = x[valid]
+        y = y[valid]
+
+        key = (axis, label)
+        if key not in self._progressive:
+            ln = ax.plot([], [], label=label, animated=True, **kwargs)[0]
+            self._lns += [ln]
+            self._progressive[key] = ln
+        ln = self._progressive[key]
+
+        if x.size:
+            xs = np.concatenate((ln.get_xdata(), x))
+            ys = np.concatenate((ln.get_ydata(), y))
+            order = np.argsort(xs, kind='stable')
+            ln.set_data(xs[order], ys[order])
+
+            x1, x2 = sorted(ax.get_xlim())
+            y1, y2 = sorted(ax.get_ylim())
+            if (x.min() < x1 or x.max() > x2 or y.min() < y1 or y.max() > y2
+                    or len(ln.get_xdata()) == x.size):
+                self._layout_changed = True
+
+        self.update_progressive()
+
+        return True
+
+    def update_progressive(self, force=False):
+        """Redraw animated lines, rate limited to blit_interval unless forced"""
+
+        now = time.time()
+        if not self._progressive or (not force and now - self._last_blit < blit_interval):
+            return
+        self._last_blit = now
+
+        if self._layout_changed or self._background is None:
+            for ax in {ln.axes for ln in self._progressive.values()}:
+                ax.relim()
+                ax.autoscale_view()
+            self._layout_changed = False
+            self.canvas.draw() # _on_draw caches the background
+            return
+
+        self.canvas.restore_region(self._background)
+        self._draw_progressive()
+        self.canvas.blit(self._fig.bbox)
+
+    def clear_progressive(self, keep=False):
+        """Remove animated lines, or keep them as ordinary lines if keep"""
+
+        for ln in self._progressive.values():
+            if keep:
+                ln.set_animated(False)
+            else:
+                ln.remove()
+                self._lns.remove(ln)
+                ln.axes.set_prop_cycle(None)
+        self._progressive.clear()
+        self._background = None
+
+    def _draw_progressive(self):
+
+        for ln in self._progressive.values():
+            ln.axes.draw_artist(ln)
+
+    def _on_draw(self, event):
+
+        # full draws skip animated artists, cache them and draw lines on top
+        if self._progressive:
+            self._background = self.canvas.copy_from_bbox(self._fig.bbox)
+            self._draw_progressive()
+
     def errorbar(self, x, y, axis='main', **kwargs):
         
         ln = self.axes[axis].errorbar(x, y, **kwargs)[0]
@@ -134,11 +374,17 @@ class PlotCanvas(QWidget):
 
         return True
 
-    def pcolormesh(self, xs, ys, zs, axis='main', **kwargs):
+    def pcolormesh(self, xs, ys, zs, axis='main', colorbar=False, **kwargs):
+        """Color map of zs with shape (ys, xs)
+
+        Parameters
+        ------
+        colorbar : bool, add a colorbar or update the existing one
+        """
 
         xs_v, ys_v = np.meshgrid(xs, ys)
 
-        self.axes[axis].pcolormesh(
+        mesh = self.axes[axis].pcolormesh(
             xs_v,
             ys_v,
             zs,
@@ -146,13 +392,22 @@ class PlotCanvas(QWidget):
             shading='auto',
             **kwargs
         )
-        
+
+        if colorbar:
+            if self._colorbar is None:
+                self._colorbar = self._fig.colorbar(mesh, ax=self.axes[axis])
+            else:
+                self._colorbar.update_normal(mesh)
+
+        return True
+
     def histogram(self, counts, bins, axis='main'):
+        """Draw precomputed counts as filled steps over bin edges"""
 
-        self.axes[axis].hist(
-            bins[:-1],
+        self.axes[axis].stairs(
+            counts,
             bins,
-            weights=counts
+            fill=True
         )
 
         return True